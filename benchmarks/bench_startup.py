@@ -0,0 +1,83 @@
+"""
+Cold start and rerun timings for the app's pages, measured with Streamlit's AppTest.
+
+Each page runs in a fresh interpreter so the first run pays for every import, then reruns
+the same session a few times, as a user clicking around would. The switch column is the
+page's first run when reached from the home page of a warm, logged-in session. Run from
+the repo root:
+
+    python benchmarks/bench_startup.py [--reruns 5] [--pages vat.py pages/...]
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _logged_in(script):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(script, default_timeout=120)
+    at.session_state["authentication_status"] = True
+    at.session_state["name"] = "Benchmark"
+    at.session_state["username"] = "benchmark"
+    return at
+
+
+def measure(page, reruns):
+    # Runs inside the child interpreter; `streamlit run` puts the repo root on the path the same way
+    sys.path.insert(0, ROOT)
+    at = _logged_in(page)
+    start = time.perf_counter()
+    at.run()
+    first = time.perf_counter() - start
+    times = []
+    for _ in range(reruns):
+        start = time.perf_counter()
+        at.run()
+        times.append(time.perf_counter() - start)
+    error = str(at.exception[0].message) if at.exception else None
+
+    home = _logged_in("vat.py")
+    home.run()
+    switch = None
+    if page != "vat.py":
+        home.switch_page(page)
+        start = time.perf_counter()
+        home.run()
+        switch = time.perf_counter() - start
+    return {"page": page, "first": first, "rerun": sum(times) / len(times) if times else 0.0,
+            "switch": switch, "error": error}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reruns", type=int, default=5)
+    parser.add_argument("--pages", nargs="*")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child, args.reruns)))
+        return
+
+    pages = args.pages or ["vat.py"] + sorted(glob.glob("pages/*.py"))
+    print(f"{'page':<45} {'first run (s)':>14} {'rerun (s)':>10} {'switch (s)':>11}")
+    for page in pages:
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, __file__, "--child", page, "--reruns", str(args.reruns)],
+                                cwd=ROOT, capture_output=True, text=True).stdout.strip().splitlines()
+        wall = time.perf_counter() - start
+        result = json.loads(output[-1]) if output else {"first": float("nan"), "rerun": float("nan"), "error": "no output"}
+        switch = f"{result['switch']:>11.3f}" if result.get("switch") is not None else f"{'-':>11}"
+        note = f"  ! {result['error']}" if result.get("error") else ""
+        print(f"{page:<45} {result['first']:>14.3f} {result['rerun']:>10.3f} {switch}   (process {wall:.1f}s){note}")
+
+
+if __name__ == "__main__":
+    main()
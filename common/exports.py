@@ -0,0 +1,106 @@
+import hashlib
+import io
+import threading
+import zipfile
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# QuickBooks rejects imports above this many lines
+CHUNK_SIZE = 4000
+
+# Built download files, shared by every session; the least recently used are dropped above this
+ARTIFACT_BUDGET_BYTES = 256 * 1024 * 1024
+
+_artifacts = OrderedDict()
+_artifacts_lock = threading.Lock()
+_artifacts_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+
+
+def chunk_bounds(group_sizes, chunk_size=CHUNK_SIZE):
+    """Greedy (start, end) row bounds over consecutive groups, never splitting a group."""
+    ends = np.cumsum(group_sizes)
+    bounds = []
+    start_group = 0
+    start_row = 0
+    while start_group < len(ends):
+        # Last group that still fits in a chunk starting at start_row
+        end_group = int(np.searchsorted(ends, start_row + chunk_size, side='right'))
+        end_group = max(end_group, start_group + 1)  # an oversized group gets a chunk of its own
+        end_row = int(ends[end_group - 1])
+        bounds.append((start_row, end_row))
+        start_group = end_group
+        start_row = end_row
+    return bounds
+
+
+def split_chunks(df, key, chunk_size=CHUNK_SIZE):
+    """Split df into chunks of at most chunk_size rows, keeping all rows of a key together."""
+    df = df.sort_values(key, kind='stable')
+    # Blank keys sort last and form one last group, so their rows are exported rather than dropped
+    group_sizes = df.groupby(key, sort=True, dropna=False).size().to_numpy()
+    return [df.iloc[start:end] for start, end in chunk_bounds(group_sizes, chunk_size)]
+
+
+def write_zip(parts):
+    """Stream (file_name, DataFrame) parts as CSV entries into one ZIP archive and return its bytes."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for file_name, frame in parts:
+            with archive.open(file_name, 'w') as entry, io.TextIOWrapper(entry, encoding='utf-8', newline='') as handle:
+                frame.to_csv(handle, index=False)
+    return buffer.getvalue()
+
+
+def write_csv(frame):
+    return frame.to_csv(index=False).encode('utf-8')
+
+
+def fingerprint(df):
+    """Short content hash of df, so artifacts built from one fetch are never served for another."""
+    return hashlib.sha256(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes()).hexdigest()[:16]
+
+
+def _artifact_size(data):
+    # Only the bytes count against the budget; extras such as messages are small
+    return len(data[0]) if isinstance(data, tuple) else len(data)
+
+
+def cached_artifact(key):
+    # The artifact for key if it is still held, without building it
+    with _artifacts_lock:
+        data = _artifacts.get(key)
+        if data is not None:
+            _artifacts.move_to_end(key)
+            _artifacts_stats['hits'] += 1
+        return data
+
+
+def artifact(key, build):
+    """
+    Bytes for key, built by build() the first time they are asked for. build() may also return a
+    tuple whose first item is the bytes and the rest small extras served with them. Built artifacts
+    are kept in a process-wide LRU; once they exceed ARTIFACT_BUDGET_BYTES the oldest are evicted
+    (the newest is always kept) and rebuilt if asked for again.
+    """
+    data = cached_artifact(key)
+    if data is not None:
+        return data
+    data = build()
+    with _artifacts_lock:
+        _artifacts_stats['misses'] += 1
+        previous = _artifacts.pop(key, None)
+        if previous is not None:
+            _artifacts_stats['bytes'] -= _artifact_size(previous)
+        _artifacts[key] = data
+        _artifacts_stats['bytes'] += _artifact_size(data)
+        while _artifacts_stats['bytes'] > ARTIFACT_BUDGET_BYTES and len(_artifacts) > 1:
+            _, evicted = _artifacts.popitem(last=False)
+            _artifacts_stats['bytes'] -= _artifact_size(evicted)
+            _artifacts_stats['evictions'] += 1
+    return data
+
+
+def artifact_info():
+    with _artifacts_lock:
+        return {**_artifacts_stats, 'artifacts': len(_artifacts)}
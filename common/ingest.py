@@ -0,0 +1,119 @@
+import hashlib
+import importlib.util
+import io
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# The upload columns the VAT report classifies, in no particular order; any others are kept for RAW IMPORTED
+REQUIRED_COLUMNS = ['Area name',
+                    'Booking code',
+                    'No. of nights',
+                    'Start date',
+                    'End date',
+                    'Supplier name',
+                    'Description',
+                    'Product group',
+                    'Product Type',
+                    'Final base sales in base currency',
+                    'Final base cost in base currency']
+
+TEXT_COLUMNS = ['Area name', 'Supplier name', 'Description', 'Product group', 'Product Type']
+AMOUNT_COLUMNS = ['Final base sales in base currency', 'Final base cost in base currency']
+DATE_COLUMNS = ['Start date', 'End date']
+
+# Rust-based reader, several times faster than openpyxl when python-calamine is installed
+EXCEL_ENGINE = 'calamine' if importlib.util.find_spec('python_calamine') else 'openpyxl'
+
+
+def missing_columns(columns):
+    return [column for column in REQUIRED_COLUMNS if column not in set(columns)]
+
+
+def _invalid_rows(raw, parsed):
+    # 1-based spreadsheet rows (after the header) holding a value that failed to convert
+    return (raw.notna() & parsed.isna()).to_numpy().nonzero()[0] + 2
+
+
+def _to_datetime(raw):
+    # Any unit or timezone (Parquet keeps both) becomes naive datetime64[ns], as the rules' dates are
+    parsed = pd.to_datetime(raw, errors='coerce')
+    if parsed.dt.tz is not None:
+        parsed = parsed.dt.tz_convert(None)
+    return parsed.astype('datetime64[ns]')
+
+
+def validate(df):
+    """Checks the required columns and converts dates and amounts column-wise, raising ValueError on bad input."""
+    missing = missing_columns(df.columns)
+    if missing:
+        raise ValueError(f"The upload is missing required columns: {', '.join(missing)}")
+
+    problems = []
+    for column in DATE_COLUMNS + AMOUNT_COLUMNS:
+        raw = df[column]
+        if column in DATE_COLUMNS:
+            parsed = _to_datetime(raw)
+        else:
+            parsed = raw if raw.dtype.kind == 'f' else pd.to_numeric(raw, errors='coerce').astype('float64')
+        rows = _invalid_rows(raw, parsed)
+        if len(rows):
+            shown = ', '.join(str(row) for row in rows[:5])
+            problems.append(f"'{column}' has {len(rows)} unreadable value(s) (rows {shown}{', ...' if len(rows) > 5 else ''})")
+        df[column] = parsed
+    if problems:
+        raise ValueError("The upload could not be read: " + '; '.join(problems))
+    if df['Start date'].isna().all():
+        raise ValueError("The upload has no Start date values")
+    return df
+
+
+def parse_excel(data):
+    """Reads an uploaded export with its text and date columns typed up front."""
+    df = pd.read_excel(io.BytesIO(data),
+                       engine=EXCEL_ENGINE,
+                       dtype={column: str for column in TEXT_COLUMNS},
+                       parse_dates=DATE_COLUMNS)
+    return validate(df)
+
+
+def parse_csv(data):
+    # Dates are converted in validate() with one vectorized to_datetime per column
+    df = pd.read_csv(io.BytesIO(data),
+                     dtype={column: str for column in TEXT_COLUMNS},
+                     encoding='utf-8-sig')
+    return validate(df)
+
+
+def parse_parquet(data):
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(io.BytesIO(data))
+    names = parquet_file.schema_arrow.names
+    missing = missing_columns(names)
+    if missing:
+        raise ValueError(f"The upload is missing required columns: {', '.join(missing)}")
+    df = parquet_file.read().to_pandas()
+    for column in TEXT_COLUMNS:
+        # Arrow strings come back with None for blanks; match the NaN the other readers give
+        df[column] = df[column].astype(object).fillna(np.nan)
+    return validate(df)
+
+
+PARSERS = {'xlsx': parse_excel, 'csv': parse_csv, 'parquet': parse_parquet}
+UPLOAD_TYPES = list(PARSERS)
+
+
+@st.cache_data(max_entries=4, show_spinner="Reading upload...")
+def _cached_upload(digest, kind, _data):
+    # Keyed on the content hash only; the bytes themselves are not hashed again by Streamlit
+    return PARSERS[kind](_data)
+
+
+def read_upload(file):
+    """Parsed frame for an uploaded .xlsx, .csv or .parquet file, parsed once per distinct file content."""
+    kind = file.name.rsplit('.', 1)[-1].lower()
+    if kind not in PARSERS:
+        raise ValueError(f"Unsupported file type '.{kind}'; upload one of: {', '.join(UPLOAD_TYPES)}")
+    data = file.getvalue()
+    return _cached_upload(hashlib.sha256(data).hexdigest(), kind, data)
@@ -0,0 +1,114 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import streamlit as st
+
+# Finished jobs nobody picked up are dropped after this many seconds
+JOB_TTL_SECONDS = 3600
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """A background fetch running in the shared worker pool."""
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.status = "queued"
+        self.stage = ""
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.finished_at = None
+        self._cancel_event = threading.Event()
+
+    def progress(self, stage, done=0, total=0):
+        # Called by the worker; doubles as the cancellation checkpoint
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+        self.stage = stage
+        self.done = done
+        self.total = total
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    @property
+    def running(self):
+        return self.status in ("queued", "running")
+
+    @property
+    def fraction(self):
+        if not self.total:
+            return 0.0
+        return min(self.done / self.total, 1.0)
+
+    def _run(self, fn, args, kwargs):
+        self.status = "running"
+        try:
+            self.result = fn(*args, progress=self.progress, **kwargs)
+            self.status = "done"
+        except JobCancelled:
+            self.status = "cancelled"
+        except Exception as e:
+            self.error = e
+            self.status = "failed"
+        finally:
+            self.finished_at = time.time()
+
+
+class JobRegistry:
+
+    def __init__(self, max_workers=4):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, name, fn, *args, **kwargs):
+        self._prune()
+        job = Job(name)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._executor.submit(job._run, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def discard(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def _prune(self):
+        cutoff = time.time() - JOB_TTL_SECONDS
+        with self._lock:
+            stale = [job_id for job_id, job in self._jobs.items() if job.finished_at and job.finished_at < cutoff]
+            for job_id in stale:
+                del self._jobs[job_id]
+
+
+@st.cache_resource
+def _registry():
+    # One registry per server process so jobs outlive reruns and page switches
+    return JobRegistry()
+
+
+def submit(name, fn, *args, **kwargs):
+    """Run fn(*args, progress=..., **kwargs) in the background and return its Job."""
+    return _registry().submit(name, fn, *args, **kwargs)
+
+
+def get(job_id):
+    if job_id is None:
+        return None
+    return _registry().get(job_id)
+
+
+def discard(job_id):
+    _registry().discard(job_id)
@@ -1,3 +1,8 @@
+import contextlib
+import glob
+import os
+import tempfile
+import time
 import streamlit as st
 import pandas as pd
 import requests
@@ -9,11 +14,47 @@ from concurrent.futures import ThreadPoolExecutor as PoolExecutor
 # Define the global supplier list
 supplierList = []
 
-def fetch_and_populate_suppliers():
-
-    global supplierList
-    supplierList.clear()  # Clear the list to fetch fresh data
-
+# Category mapping
+category_mapping = {
+    "1": "Cross Sell Hotel",
+    "2": "Dynamic Hotel",
+    "3": "Static Hotel",
+    "4": "Extranet Hotel",
+    "5": "XML Hotel",
+    "6": "Tickets",
+    "7": "Offline Hotel",
+    "8": "Excursions",
+    "9": "Visa"
+}
+
+# Account mapping
+account_mapping = {
+    "1": "Cross Sell - COS",
+    "2": "Dynamic COS",
+    "3": "Static - COS",
+    "4": "Extranet - COS",
+    "5": "XML - COS",
+    "6": "Tickets- COS",
+    "7": "Offline Hotel",
+    "8": "Excursions - COS",
+    "9": "Visas - COS"
+}
+
+# VAT report Service Type for each supplier category; anything else is reported as Other
+service_type_mapping = {
+    "1": "Hotel Reservation",
+    "2": "Hotel Reservation",
+    "3": "Hotel Reservation",
+    "4": "Hotel Reservation",
+    "5": "Hotel Reservation",
+    "6": "Air Ticket",
+    "7": "Hotel Reservation",
+    "8": "Excursion",
+    "9": "Visa"
+}
+
+def fetch_supplier_list():
+    """Every Juniper supplier with its id, name and category; raises RuntimeError if the request fails."""
     # URL and headers
     url = "https://www.gte.travel/wsExportacion/wssuppliers.asmx/getSupplierList"
     headers = {
@@ -29,55 +70,37 @@ def fetch_and_populate_suppliers():
         "creationDateFrom": "",
         "creationDateTo": ""
     }
-    
-    # Category mapping
-    category_mapping = {
-        "1": "Cross Sell Hotel",
-        "2": "Dynamic Hotel",
-        "3": "Static Hotel",
-        "4": "Extranet Hotel",
-        "5": "XML Hotel",
-        "6": "Tickets",
-        "7": "Offline Hotel",
-        "8": "Excursions",
-        "9": "Visa"
-    }
-
-    # Account mapping
-    account_mapping = {
-        "1": "Cross Sell - COS",
-        "2": "Dynamic COS",
-        "3": "Static - COS",
-        "4": "Extranet - COS",
-        "5": "XML - COS",
-        "6": "Tickets- COS",
-        "7": "Offline Hotel",
-        "8": "Excursions - COS",
-        "9": "Visas - COS"
-    }
 
     response = requests.post(url, headers=headers, data=data)
 
-    if response.status_code == 200:        
-        # Parse the XML response
-        root = ET.fromstring(response.text)
-        
-        # Extract supplier information
-        for supplier in root.findall(".//Supplier"):
-            category_element = supplier.find(".//Category")
-            category_id = category_element.get('Id') if category_element is not None else None
-            category_name = category_mapping.get(category_id, "Others")
-            account_name = account_mapping.get(category_id, "Others")
-            
-            supplier_data = {
-                "Supplier Id": supplier.get("Id"),
-                "Category Id": category_id,
-                "Product Name": category_name,
-                "Account Name": account_name,
-            }
-            supplierList.append(supplier_data)                
-    else:
-        st.error(f"Failed to fetch suppliers. Status code: {response.status_code}")
+    # Raised rather than shown: this also runs in background fetch jobs, where st.error draws nothing
+    if response.status_code != 200:
+        raise RuntimeError(f"Failed to fetch suppliers. Status code: {response.status_code}")
+
+    # Parse the XML response
+    root = ET.fromstring(response.text)
+
+    # Extract supplier information. Each <Supplier Id=".."> carries its own <Name> as a direct
+    # child (or a Name attribute) next to a <Category Id=".."> that may hold a <Name> of its own
+    suppliers = []
+    for supplier in root.findall(".//Supplier"):
+        category_element = supplier.find(".//Category")
+        category_id = category_element.get('Id') if category_element is not None else None
+        suppliers.append({
+            "Supplier Id": supplier.get("Id"),
+            "Supplier Name": (supplier.findtext("Name") or supplier.get("Name") or "").strip(),
+            "Category Id": category_id,
+            "Product Name": category_mapping.get(category_id, "Others"),
+            "Account Name": account_mapping.get(category_id, "Others"),
+            "Service Type": service_type_mapping.get(category_id, "Other"),
+        })
+    return suppliers
+
+def fetch_and_populate_suppliers():
+
+    global supplierList
+    # Build a fresh list and swap it in so concurrent fetches never see it half-filled
+    supplierList = fetch_supplier_list()
 
 def get_product_and_account(supplier_id):
     global supplierList
@@ -93,7 +116,7 @@ def format_date(date_str):
     return ""
 
 
-def fetch_invoice_details(invoice_date_from, invoice_date_to):
+def fetch_invoice_details(invoice_date_from, invoice_date_to, progress=None):
     # URL and headers
     url = "https://www.gte.travel/wsExportacion/wsinvoices.asmx/GetInvoices"
     headers = {
@@ -127,7 +150,10 @@ def fetch_invoice_details(invoice_date_from, invoice_date_to):
 
         invoices = []
 
-        for invoice in root.findall(".//Invoice"):
+        invoice_elems = root.findall(".//Invoice")
+        for parsed, invoice in enumerate(invoice_elems, start=1):
+            if progress:
+                progress("Parsing invoices", parsed, len(invoice_elems))
             invoice_number = invoice.get("InvoiceNumber")
             invoice_date = format_date(invoice.get("InvoiceDate"))
             # due_date = format_date(invoice.get("DueDate"))
@@ -186,8 +212,7 @@ def fetch_invoice_details(invoice_date_from, invoice_date_to):
         df = pd.DataFrame(invoices)
         return df
     else:
-        st.error(f"Failed to fetch invoices. Status code: {response.status_code}")
-        return pd.DataFrame()
+        raise RuntimeError(f"Failed to fetch invoices. Status code: {response.status_code}")
 
 @sleep_and_retry
 @limits(calls=1000, period=1)
@@ -314,19 +339,24 @@ def get_booking_details(booking_code):
             print(f"Error fetching data for {booking_code}: {e}")
             return []
 
-def fetch_booking_details_concurrently(booking_codes, max_workers=1000):
+def _fetch_concurrently(fn, keys, max_workers, stage, progress):
     results = []
-    with PoolExecutor(max_workers=max_workers) as executor:
-        for result in executor.map(get_booking_details, booking_codes):
+    executor = PoolExecutor(max_workers=max_workers)
+    try:
+        for done, result in enumerate(executor.map(fn, keys), start=1):
             results.extend(result)
+            if progress:
+                progress(stage, done, len(keys))
+    finally:
+        # On cancellation drop whatever has not started yet
+        executor.shutdown(wait=True, cancel_futures=True)
     return results
 
-def fetch_customer_info_concurrently(customer_ids, max_workers=1000):
-    results = []
-    with PoolExecutor(max_workers=max_workers) as executor:
-        for result in executor.map(get_customer_info, customer_ids):
-            results.extend(result)
-    return results
+def fetch_booking_details_concurrently(booking_codes, max_workers=1000, progress=None):
+    return _fetch_concurrently(get_booking_details, booking_codes, max_workers, "Resolving bookings", progress)
+
+def fetch_customer_info_concurrently(customer_ids, max_workers=1000, progress=None):
+    return _fetch_concurrently(get_customer_info, customer_ids, max_workers, "Resolving customers", progress)
 
 # Function to remove time from datetime string
 def format_date(date_str):
@@ -341,7 +371,7 @@ def currency_converter(amount, cost_rate, sell_rate):
     return round(final_conversion, 2)
 
 # Fetch bills function
-def get_bill_details(invoice_date_from, invoice_date_to):
+def get_bill_details(invoice_date_from, invoice_date_to, progress=None):
     url = "https://www.gte.travel/wsExportacion/wsinvoices.asmx/GetInvoices"
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
     data = {
@@ -369,7 +399,10 @@ def get_bill_details(invoice_date_from, invoice_date_to):
         root = ET.fromstring(response.text)
         invoices = []
 
-        for invoice in root.findall(".//Invoice"):
+        invoice_elems = root.findall(".//Invoice")
+        for parsed, invoice in enumerate(invoice_elems, start=1):
+            if progress:
+                progress("Parsing invoices", parsed, len(invoice_elems))
             invoice_number = invoice.get("InvoiceNumber")
             invoice_date = format_date(invoice.get("InvoiceDate"))
             due_date = format_date(invoice.get("DueDate"))
@@ -414,8 +447,7 @@ def get_bill_details(invoice_date_from, invoice_date_to):
         df = pd.DataFrame(invoices)
         return df        
     else:
-        st.error(f"Failed to fetch invoices. Status code: {response.status_code}")
-        return pd.DataFrame()
+        raise RuntimeError(f"Failed to fetch bills. Status code: {response.status_code}")
 
 def add_suffix_to_duplicate_bills(df):
     """
@@ -438,12 +470,130 @@ def add_suffix_to_duplicate_bills(df):
 
 
 
-def fetch_invoices(invoice_date_from, invoice_date_to):
+# Previous fetch results, kept so a period can be re-fetched incrementally
+FETCH_CACHE_DIR = ".fetch_cache"
+# Cached fetches older than this are removed on the next save
+FETCH_CACHE_MAX_AGE_SECONDS = 14 * 24 * 3600
 
-    invoices = fetch_invoice_details(invoice_date_from, invoice_date_to)
-    customer_ids = invoices["Customer Id"].unique().tolist()
-    invoice_details = fetch_customer_info_concurrently(customer_ids)
-    invoice_details_df = pd.DataFrame(invoice_details, columns=["Customer Id", "Account Manager", "Payment Terms", "Location"])
+def _fetch_cache_path(kind, invoice_date_from, invoice_date_to):
+    return os.path.join(FETCH_CACHE_DIR, f"{kind}_{invoice_date_from}_{invoice_date_to}.pkl")
+
+def load_previous_fetch(kind, invoice_date_from, invoice_date_to):
+    try:
+        return pd.read_pickle(_fetch_cache_path(kind, invoice_date_from, invoice_date_to))
+    except Exception:
+        # Missing, truncated or unreadable: a cache miss, so the period is fetched in full
+        return None
+
+def has_previous_fetch(kind, invoice_date_from, invoice_date_to):
+    return os.path.exists(_fetch_cache_path(kind, invoice_date_from, invoice_date_to))
+
+def save_fetch(kind, invoice_date_from, invoice_date_to, fetched_at, lines, details, result):
+    os.makedirs(FETCH_CACHE_DIR, exist_ok=True)
+    snapshot = {"fetched_at": fetched_at, "lines": lines, "details": details, "result": result}
+    path = _fetch_cache_path(kind, invoice_date_from, invoice_date_to)
+    # Written to a temp file and renamed into place, so an interrupted write never leaves a truncated pickle
+    fd, temp_path = tempfile.mkstemp(dir=FETCH_CACHE_DIR, prefix=f"{kind}_", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            pd.to_pickle(snapshot, file)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    # One file per kind and period; ones (and leftover temp files) not refreshed for a while are
+    # dropped. Another job may be removing the same file, so a file that is already gone is fine
+    expired = time.time() - FETCH_CACHE_MAX_AGE_SECONDS
+    for old_path in glob.glob(os.path.join(FETCH_CACHE_DIR, "*")):
+        with contextlib.suppress(FileNotFoundError):
+            if os.path.getmtime(old_path) < expired:
+                os.remove(old_path)
+
+def invoice_fingerprints(df, key):
+    # One order-independent hash per invoice over all of its lines
+    row_hashes = pd.util.hash_pandas_object(df.drop(columns=[key]), index=False)
+    return row_hashes.groupby(df[key].to_numpy()).sum()
+
+def diff_invoices(current, previous, key):
+    """Change report between two results: one row per added, changed or removed invoice."""
+    current_fp = invoice_fingerprints(current, key) if not current.empty else pd.Series(dtype="uint64")
+    previous_fp = invoice_fingerprints(previous, key) if not previous.empty else pd.Series(dtype="uint64")
+    both = current_fp.index.intersection(previous_fp.index)
+    changed = both[current_fp[both].to_numpy() != previous_fp[both].to_numpy()]
+    report = pd.concat([
+        pd.DataFrame({key: current_fp.index.difference(previous_fp.index), "Change": "Added"}),
+        pd.DataFrame({key: changed, "Change": "Changed"}),
+        pd.DataFrame({key: previous_fp.index.difference(current_fp.index), "Change": "Removed"}),
+    ], ignore_index=True)
+    return report.sort_values(key, ignore_index=True)
+
+def _changed_keys(current, previous, key, value_column):
+    # value_column values belonging to invoices that are new or differ from the previous fetch
+    report = diff_invoices(current, previous, key)
+    touched = report.loc[report["Change"] != "Removed", key]
+    return set(current.loc[current[key].isin(touched), value_column])
+
+def _fetch_modified_ids(url, data, element, attribute):
+    # None when the list could not be read; callers then refresh every id instead of assuming nothing changed
+    try:
+        response = requests.post(url, headers={"Content-Type": "application/x-www-form-urlencoded"}, data=data)
+        if response.status_code != 200:
+            return None
+        root = ET.fromstring(response.text)
+    except (requests.RequestException, ET.ParseError):
+        return None
+    return {elem.get(attribute) for elem in root.findall(f".//{element}") if elem.get(attribute)}
+
+def fetch_modified_customer_ids(since):
+    data = {
+        "user": st.secrets["gte_user"],
+        "password": st.secrets["gte_password"],
+        "customerType": "",
+        "creationDateFrom": "",
+        "creationDateTo": "",
+        "id": "",
+        "BranchType": "",
+        "ExportMode": "",
+        "LastModifiedDateFrom": since.strftime("%Y%m%d"),
+        "LastModifiedDateTo": "",
+        "LastModifiedTimeFrom": "",
+        "LastModifiedTimeTo": "",
+        "AmountBaseCurrency": ""
+    }
+    return _fetch_modified_ids("https://www.gte.travel/wsExportacion/wsCustomers.asmx/getCustomerList", data, "Customer", "Id")
+
+def fetch_modified_booking_codes(since):
+    data = {
+        "user": st.secrets["gte_user"],
+        "password": st.secrets["gte_password"],
+        'BookingCode': '',
+        'BookingDateFrom': '',
+        'BookingDateTo': '',
+        'BookingTimeFrom': '',
+        'BookingTimeTo': '',
+        'BeginTravelDate': '',
+        'EndTravelDate': '',
+        'LastModifiedDateFrom': since.strftime("%Y%m%d"),
+        'LastModifiedDateTo': '',
+        'LastModifiedTimeFrom': '',
+        'LastModifiedTimeTo': '',
+        'Status': '',
+        'id': '',
+        'ExportMode': '',
+        'channel': '',
+        'ModuleType': '',
+        'IdBooking': '',
+        'AgencyRef': '',
+        'BeginTravelDateFrom': '',
+        'BeginTravelDateTo': '',
+        'EndTravelDateFrom': '',
+        'EndTravelDateTo': '',
+        'PackageBookings': '',
+        'BlockedBookings': ''    }
+    return _fetch_modified_ids("https://www.gte.travel/wsExportacion/wsbookings.asmx/getBookings", data, "Booking", "BookingCode")
+
+
+def _build_invoices(invoices, invoice_details_df):
     merged_df = pd.merge(invoices, invoice_details_df, on=["Customer Id"], how="inner")
     filtered_df = merged_df.sort_values(by='Invoice No')
     bill_line_count = filtered_df['Invoice No'].count()
@@ -451,13 +601,53 @@ def fetch_invoices(invoice_date_from, invoice_date_to):
     filtered_df = filtered_df.drop(columns=["Customer Id"])
     return bill_count, bill_line_count, filtered_df
 
+def fetch_invoices(invoice_date_from, invoice_date_to, progress=None):
 
-def fetch_bills(invoice_date_from, invoice_date_to):
+    fetched_at = datetime.now()
+    invoices = fetch_invoice_details(invoice_date_from, invoice_date_to, progress)
+    if invoices.empty:
+        return 0, 0, invoices
+    customer_ids = invoices["Customer Id"].unique().tolist()
+    invoice_details = fetch_customer_info_concurrently(customer_ids, progress=progress)
+    invoice_details_df = pd.DataFrame(invoice_details, columns=["Customer Id", "Account Manager", "Payment Terms", "Location"])
+    bill_count, bill_line_count, filtered_df = _build_invoices(invoices, invoice_details_df)
+    save_fetch("invoices", invoice_date_from, invoice_date_to, fetched_at, invoices, invoice_details_df, filtered_df)
+    return bill_count, bill_line_count, filtered_df
 
-    bills = get_bill_details(invoice_date_from, invoice_date_to)
-    booking_codes = bills["Booking Code"].unique().tolist()
-    booking_details = fetch_booking_details_concurrently(booking_codes)
-    booking_details_df = pd.DataFrame(booking_details, columns=["Booking Code", "IdBookLine", "Line Amount", "Line Tax Amount", "Status"])
+def fetch_invoices_incremental(invoice_date_from, invoice_date_to, progress=None):
+    """
+    Re-fetches a period fetched before, resolving customers only for new or changed
+    invoices and customers modified since the last run. Returns the merged result and a change report.
+    """
+    previous = load_previous_fetch("invoices", invoice_date_from, invoice_date_to)
+    if previous is None:
+        bill_count, bill_line_count, filtered_df = fetch_invoices(invoice_date_from, invoice_date_to, progress)
+        return bill_count, bill_line_count, filtered_df, diff_invoices(filtered_df, pd.DataFrame(), "Invoice No")
+
+    fetched_at = datetime.now()
+    invoices = fetch_invoice_details(invoice_date_from, invoice_date_to, progress)
+    if invoices.empty:
+        return 0, 0, invoices, diff_invoices(invoices, previous["result"], "Invoice No")
+
+    previous_details = previous["details"]
+    stale = _changed_keys(invoices, previous["lines"], "Invoice No", "Customer Id")
+    modified = fetch_modified_customer_ids(previous["fetched_at"])
+    stale |= set(invoices["Customer Id"]) if modified is None else modified & set(invoices["Customer Id"])
+    stale |= set(invoices["Customer Id"]) - set(previous_details["Customer Id"])
+
+    invoice_details = fetch_customer_info_concurrently(sorted(stale), progress=progress)
+    invoice_details_df = pd.concat([
+        previous_details[~previous_details["Customer Id"].isin(stale)],
+        pd.DataFrame(invoice_details, columns=previous_details.columns),
+    ], ignore_index=True)
+
+    bill_count, bill_line_count, filtered_df = _build_invoices(invoices, invoice_details_df)
+    changes = diff_invoices(filtered_df, previous["result"], "Invoice No")
+    save_fetch("invoices", invoice_date_from, invoice_date_to, fetched_at, invoices, invoice_details_df, filtered_df)
+    return bill_count, bill_line_count, filtered_df, changes
+
+
+def _build_bills(bills, booking_details_df):
     merged_df = pd.merge(bills, booking_details_df, on=["Booking Code", "IdBookLine"], how="inner")
     merged_df['Line Amount'] = merged_df.apply(lambda row: currency_converter(row['Line Amount'], row['CostExchangeRate'], row['SellExchangeRate']), axis=1)
     merged_df['Line Tax Amount'] = merged_df.apply(lambda row: currency_converter(row['Line Tax Amount'], row['CostExchangeRate'], row['SellExchangeRate']), axis=1)
@@ -470,4 +660,49 @@ def fetch_bills(invoice_date_from, invoice_date_to):
     bill_count = filtered_df['Bill No'].nunique()
     filtered_df = add_suffix_to_duplicate_bills(filtered_df)
 
-    return bill_count, bill_line_count, filtered_df
\ No newline at end of file
+    return bill_count, bill_line_count, filtered_df
+
+def fetch_bills(invoice_date_from, invoice_date_to, progress=None):
+
+    fetched_at = datetime.now()
+    bills = get_bill_details(invoice_date_from, invoice_date_to, progress)
+    if bills.empty:
+        return 0, 0, bills
+    booking_codes = bills["Booking Code"].unique().tolist()
+    booking_details = fetch_booking_details_concurrently(booking_codes, progress=progress)
+    booking_details_df = pd.DataFrame(booking_details, columns=["Booking Code", "IdBookLine", "Line Amount", "Line Tax Amount", "Status"])
+    bill_count, bill_line_count, filtered_df = _build_bills(bills, booking_details_df)
+    save_fetch("bills", invoice_date_from, invoice_date_to, fetched_at, bills, booking_details_df, filtered_df)
+    return bill_count, bill_line_count, filtered_df
+
+def fetch_bills_incremental(invoice_date_from, invoice_date_to, progress=None):
+    """
+    Re-fetches a period fetched before, resolving bookings only for new or changed
+    invoices and bookings modified since the last run. Returns the merged result and a change report.
+    """
+    previous = load_previous_fetch("bills", invoice_date_from, invoice_date_to)
+    if previous is None:
+        bill_count, bill_line_count, filtered_df = fetch_bills(invoice_date_from, invoice_date_to, progress)
+        return bill_count, bill_line_count, filtered_df, diff_invoices(filtered_df, pd.DataFrame(), "Bill No")
+
+    fetched_at = datetime.now()
+    bills = get_bill_details(invoice_date_from, invoice_date_to, progress)
+    if bills.empty:
+        return 0, 0, bills, diff_invoices(bills, previous["result"], "Bill No")
+
+    previous_details = previous["details"]
+    stale = _changed_keys(bills, previous["lines"], "Bill No", "Booking Code")
+    modified = fetch_modified_booking_codes(previous["fetched_at"])
+    stale |= set(bills["Booking Code"]) if modified is None else modified & set(bills["Booking Code"])
+    stale |= set(bills["Booking Code"]) - set(previous_details["Booking Code"])
+
+    booking_details = fetch_booking_details_concurrently(sorted(stale), progress=progress)
+    booking_details_df = pd.concat([
+        previous_details[~previous_details["Booking Code"].isin(stale)],
+        pd.DataFrame(booking_details, columns=previous_details.columns),
+    ], ignore_index=True)
+
+    bill_count, bill_line_count, filtered_df = _build_bills(bills, booking_details_df)
+    changes = diff_invoices(filtered_df, previous["result"], "Bill No")
+    save_fetch("bills", invoice_date_from, invoice_date_to, fetched_at, bills, booking_details_df, filtered_df)
+    return bill_count, bill_line_count, filtered_df, changes
@@ -0,0 +1,89 @@
+import math
+import numpy as np
+import pandas as pd
+import streamlit as st
+from common import rules_store
+
+ALL_COLUMNS = "All columns"
+
+
+def _contains(series, text):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Match each distinct value once, then broadcast through the codes (-1 picks the trailing False)
+        matched = series.cat.categories.astype(str).str.contains(text, case=False, regex=False)
+        return np.append(matched, False)[series.cat.codes.to_numpy()]
+    return series.astype(str).str.contains(text, case=False, regex=False, na=False).to_numpy()
+
+
+def filter_frame(df, text, column=ALL_COLUMNS):
+    """Rows of df where text appears (case-insensitive) in column, or in any text column."""
+    if not text:
+        return df
+    if column != ALL_COLUMNS:
+        return df[_contains(df[column], text)]
+    mask = None
+    for name in df.columns:
+        if pd.api.types.is_numeric_dtype(df[name]):
+            continue
+        matched = _contains(df[name], text)
+        mask = matched if mask is None else mask | matched
+    return df if mask is None else df[mask]
+
+
+def sort_frame(df, column, descending=False):
+    if column is None:
+        return df
+    return df.sort_values(column, ascending=not descending, kind='stable')
+
+
+def _controls(columns, key):
+    search_col, column_col, sort_col, order_col = st.columns([3, 2, 2, 1])
+    text = search_col.text_input("Search", key=f"{key}_search")
+    column = column_col.selectbox("In", options=[ALL_COLUMNS] + list(columns), key=f"{key}_column")
+    sort_by = sort_col.selectbox("Sort by", options=[None] + list(columns), key=f"{key}_sort")
+    descending = order_col.checkbox("Desc", key=f"{key}_desc")
+    return text, column, sort_by, descending
+
+
+def _show_page(page_df, key, **grid_kwargs):
+    # st_aggrid is only loaded once a page actually has a grid to show
+    from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode
+    grid_options = GridOptionsBuilder.from_dataframe(page_df)
+    grid_options.configure_side_bar(False, False)
+    AgGrid(page_df, gridOptions=grid_options.build(), update_mode=GridUpdateMode.NO_UPDATE, key=f"{key}_grid", **grid_kwargs)
+
+
+def paged_preview(df, key, total_columns=(), page_size=100):
+    """Filter, sort and page df on the server and send only the visible page to the grid."""
+    text, column, sort_by, descending = _controls(df.columns, key)
+
+    view = sort_frame(filter_frame(df, text, column), sort_by, descending)
+
+    metrics = st.columns(len(total_columns) + 1)
+    metrics[0].metric("Rows", f"{len(view):,}")
+    for metric, name in zip(metrics[1:], total_columns):
+        metric.metric(name, f"{view[name].sum():,.2f}")
+
+    pages = max(math.ceil(len(view) / page_size), 1)
+    if st.session_state.get(f"{key}_page", 1) > pages:
+        st.session_state[f"{key}_page"] = pages
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, step=1, key=f"{key}_page")
+    _show_page(view.iloc[(page - 1) * page_size:page * page_size].reset_index(names='#'), key)
+
+
+def rules_grid(filename, key, page_size=20):
+    """Searchable, sortable grid over a rules store table; only the visible page is queried and sent."""
+    text, column, sort_by, descending = _controls(rules_store.rule_columns(filename), key)
+    column = None if column == ALL_COLUMNS else column
+
+    page = st.session_state.get(f"{key}_page", 1)
+    page_df, total = rules_store.query(filename, text, column, sort_by, descending, limit=page_size, offset=(page - 1) * page_size)
+    pages = max(math.ceil(total / page_size), 1)
+    if page > pages:
+        # The filter shrank the result below the current page
+        page = st.session_state[f"{key}_page"] = pages
+        page_df, total = rules_store.query(filename, text, column, sort_by, descending, limit=page_size, offset=(page - 1) * page_size)
+
+    st.caption(f"{total:,} rule(s)")
+    st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, step=1, key=f"{key}_page")
+    _show_page(page_df, key, fit_columns_on_grid_load=True)
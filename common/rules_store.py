@@ -0,0 +1,279 @@
+import os
+import sqlite3
+import pandas as pd
+
+# Embedded database holding the rule tables; created next to the CSVs it was imported from
+DB_PATH = 'rules.db'
+
+# Rule file name -> (table, key column, {column: SQL type}); the file names are what the pages pass around
+TABLES = {
+    'suppliers.csv': ('suppliers', 'Supplier Name', {'Supplier Name': 'TEXT', 'Service Type': 'TEXT', 'Taxes Included': 'INTEGER'}),
+    'areas.csv': ('areas', 'Area', {'Area': 'TEXT', 'Emirate': 'TEXT'}),
+    'services.csv': ('services', 'Service Type', {'Service Type': 'TEXT', 'VAT Exempt': 'INTEGER'}),
+    'vat_setup.csv': ('vat_setup', 'Emirate', {'Emirate': 'TEXT', 'Basic Division': 'REAL', 'Service Charge': 'REAL',
+                                               'Municipality Fee': 'REAL', 'VAT Percentage': 'REAL'}),
+    # Other spellings of supplier and area names seen in uploads -> the name the rules use
+    'supplier_aliases.csv': ('supplier_aliases', 'Alias', {'Alias': 'TEXT', 'Name': 'TEXT'}),
+    'area_aliases.csv': ('area_aliases', 'Alias', {'Alias': 'TEXT', 'Name': 'TEXT'}),
+}
+
+# Tables whose rows carry an effective date range, so old periods can be reported with the rules of the time
+VERSIONED = {'suppliers.csv', 'areas.csv', 'vat_setup.csv'}
+EFFECTIVE_FROM = 'Effective From'
+EFFECTIVE_TO = 'Effective To'
+# Effective From of rules that have always applied (everything imported from the CSVs)
+ALWAYS = '1900-01-01'
+
+
+def manages(filename):
+    return os.path.basename(filename) in TABLES
+
+
+def is_versioned(filename):
+    return os.path.basename(filename) in VERSIONED
+
+
+def _table(filename):
+    return TABLES[os.path.basename(filename)]
+
+
+def _columns(filename):
+    # Stored columns: the rule columns, plus the date range for versioned tables
+    columns = dict(_table(filename)[2])
+    if is_versioned(filename):
+        columns.update({EFFECTIVE_FROM: 'TEXT NOT NULL', EFFECTIVE_TO: 'TEXT'})
+    return columns
+
+
+def _primary_key(filename):
+    key = _table(filename)[1]
+    return [key, EFFECTIVE_FROM] if is_versioned(filename) else [key]
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _create(conn, filename, table=None):
+    table = table or _table(filename)[0]
+    definitions = ', '.join(f"{_quote(column)} {sql_type}" for column, sql_type in _columns(filename).items())
+    primary_key = ', '.join(_quote(column) for column in _primary_key(filename))
+    conn.execute(f"CREATE TABLE {table} ({definitions}, PRIMARY KEY ({primary_key}))")
+
+
+def _import_csv(conn, filename):
+    conn.execute("INSERT OR IGNORE INTO revisions (name, revision) VALUES (?, 0)", (_table(filename)[0],))
+    # One-time import of the CSV the table replaces; the first row wins for repeated keys, as in the lookups
+    csv_path = os.path.join(os.path.dirname(DB_PATH), os.path.basename(filename))
+    if os.path.exists(csv_path):
+        df = pd.read_csv(csv_path)
+        _insert(conn, filename, df, "INSERT OR IGNORE")
+
+
+def _add_versions(conn, filename):
+    # Tables created before rules were versioned: rebuild with the date range, every row effective always
+    table, _, columns = _table(filename)
+    names = ', '.join(_quote(column) for column in columns)
+    _create(conn, filename, table=f"{table}_versioned")
+    conn.execute(f"INSERT INTO {table}_versioned ({names}, {_quote(EFFECTIVE_FROM)}) SELECT {names}, ? FROM {table} ORDER BY rowid", (ALWAYS,))
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE {table}_versioned RENAME TO {table}")
+
+
+_initialised = set()
+
+
+def _initialise():
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    try:
+        with conn:
+            # Write lock first, so two processes starting together cannot both run the import
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("CREATE TABLE IF NOT EXISTS revisions (name TEXT PRIMARY KEY, revision INTEGER NOT NULL)")
+            existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            for filename, (table, _, _) in TABLES.items():
+                if table not in existing:
+                    _create(conn, filename)
+                    _import_csv(conn, filename)
+                elif is_versioned(filename):
+                    stored = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+                    if EFFECTIVE_FROM not in stored:
+                        _add_versions(conn, filename)
+    finally:
+        conn.close()
+    _initialised.add(os.path.abspath(DB_PATH))
+
+
+def connect():
+    """Connection with every rule table present, importing the CSVs on first use."""
+    if os.path.abspath(DB_PATH) not in _initialised:
+        _initialise()
+    return sqlite3.connect(DB_PATH, timeout=30)
+
+
+def _iso_dates(series):
+    return pd.to_datetime(series).dt.strftime('%Y-%m-%d')
+
+
+def _records(filename, df):
+    columns = _columns(filename)
+    df = df.reindex(columns=list(columns))
+    for column, sql_type in columns.items():
+        if sql_type == 'INTEGER':
+            df[column] = df[column].map({True: 1, False: 0, 'True': 1, 'False': 0, 1: 1, 0: 0})
+    if is_versioned(filename):
+        df[EFFECTIVE_FROM] = _iso_dates(df[EFFECTIVE_FROM]).fillna(ALWAYS)
+        df[EFFECTIVE_TO] = None  # derived from the next version, see _chain_versions
+    return df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+
+def _chain_versions(conn, filename, keys):
+    # Each version runs until the next one for the same key starts; the latest stays open (NULL)
+    table, key, _ = _table(filename)
+    conn.executemany(f"""UPDATE {table} SET {_quote(EFFECTIVE_TO)} = (
+                             SELECT MIN(later.{_quote(EFFECTIVE_FROM)}) FROM {table} AS later
+                             WHERE later.{_quote(key)} = {table}.{_quote(key)}
+                               AND later.{_quote(EFFECTIVE_FROM)} > {table}.{_quote(EFFECTIVE_FROM)})
+                         WHERE {_quote(key)} = ?""", ((value,) for value in keys))
+
+
+def _insert(conn, filename, df, verb):
+    table, key, _ = _table(filename)
+    columns = _columns(filename)
+    names = ', '.join(_quote(column) for column in columns)
+    placeholders = ', '.join('?' for _ in columns)
+    sql = f"{verb} INTO {table} ({names}) VALUES ({placeholders})"
+    if verb == "INSERT":
+        # Upsert on the primary key: an index lookup and a one-row write
+        conflict = ', '.join(_quote(column) for column in _primary_key(filename))
+        updates = ', '.join(f"{_quote(column)} = excluded.{_quote(column)}" for column in columns if column not in _primary_key(filename) and column != EFFECTIVE_TO)
+        sql += f" ON CONFLICT ({conflict}) DO UPDATE SET {updates}"
+    conn.executemany(sql, _records(filename, df))
+    if is_versioned(filename):
+        _chain_versions(conn, filename, df[key].dropna().unique().tolist())
+    conn.execute("UPDATE revisions SET revision = revision + 1 WHERE name = ?", (table,))
+
+
+def _current_versions(conn, filename, keys):
+    # Effective From of the version in force for each key, ALWAYS for keys without one
+    table, key, _ = _table(filename)
+    sql = f"SELECT {_quote(EFFECTIVE_FROM)} FROM {table} WHERE {_quote(key)} = ? AND {_quote(EFFECTIVE_TO)} IS NULL"
+    return [(conn.execute(sql, (value,)).fetchone() or (ALWAYS,))[0] for value in keys]
+
+
+def upsert(filename, rows, effective_from=None):
+    """
+    Inserts or updates rows (a dict, list of dicts or DataFrame) by key in one transaction.
+    For versioned tables, effective_from starts a new version of each rule from that date;
+    without it, rows carrying no Effective From correct the version currently in force.
+    """
+    if isinstance(rows, dict):
+        rows = [rows]
+    df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+    conn = connect()
+    try:
+        with conn:
+            if is_versioned(filename):
+                df = df.copy()
+                if effective_from is not None:
+                    df[EFFECTIVE_FROM] = pd.Timestamp(effective_from)
+                elif EFFECTIVE_FROM not in df.columns or df[EFFECTIVE_FROM].isna().any():
+                    current = _current_versions(conn, filename, df[_table(filename)[1]].tolist())
+                    given = df[EFFECTIVE_FROM] if EFFECTIVE_FROM in df.columns else pd.Series(None, index=df.index, dtype=object)
+                    df[EFFECTIVE_FROM] = given.where(given.notna(), pd.Series(current, index=df.index))
+            _insert(conn, filename, df, "INSERT")
+    finally:
+        conn.close()
+
+
+def revision(filename):
+    # Bumped by every write, so readers can cache on it
+    conn = connect()
+    try:
+        return conn.execute("SELECT revision FROM revisions WHERE name = ?", (_table(filename)[0],)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def rule_columns(filename):
+    return list(_table(filename)[2])
+
+
+def _booleans(filename, df):
+    # INTEGER flag columns come back from SQLite as 0/1
+    for column, sql_type in _columns(filename).items():
+        if sql_type == 'INTEGER' and column in df.columns:
+            df[column] = df[column].map({1: True, 0: False})
+    return df
+
+
+def _read(filename, where=""):
+    table = _table(filename)[0]
+    conn = connect()
+    try:
+        df = pd.read_sql_query(f"SELECT * FROM {table} {where} ORDER BY rowid", conn)
+    finally:
+        conn.close()
+    return _booleans(filename, df)
+
+
+def read(filename):
+    """The latest version of each rule, as a DataFrame with the CSV's column names, in insertion order."""
+    if not is_versioned(filename):
+        return _read(filename)
+    df = _read(filename, where=f"WHERE {_quote(EFFECTIVE_TO)} IS NULL")
+    return df.drop(columns=[EFFECTIVE_FROM, EFFECTIVE_TO])
+
+
+def read_history(filename):
+    """Every version of the rules, with Effective From / Effective To (NaT while open) as dates."""
+    df = _read(filename)
+    if is_versioned(filename):
+        df[EFFECTIVE_FROM] = pd.to_datetime(df[EFFECTIVE_FROM])
+        df[EFFECTIVE_TO] = pd.to_datetime(df[EFFECTIVE_TO])
+    return df
+
+
+def query(filename, search="", column=None, sort=None, descending=False, limit=100, offset=0):
+    """
+    One page of the latest rules, optionally filtered by a case-insensitive substring (in column,
+    or in any text column) and sorted, together with the number of matching rows.
+    """
+    table, key, columns = _table(filename)
+    text_columns = [name for name, sql_type in columns.items() if sql_type == 'TEXT']
+    conditions, params = [], []
+    if is_versioned(filename):
+        conditions.append(f"{_quote(EFFECTIVE_TO)} IS NULL")
+    if search:
+        searched = [column] if column else text_columns
+        conditions.append('(' + ' OR '.join(f"{_quote(name)} LIKE ? ESCAPE '\\'" for name in searched) + ')')
+        pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        params += [pattern] * len(searched)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    collate = " COLLATE NOCASE" if columns.get(sort) == 'TEXT' else ""
+    order = f"{_quote(sort)}{collate} {'DESC' if descending else 'ASC'}, rowid" if sort in columns else "rowid"
+
+    conn = connect()
+    try:
+        total = conn.execute(f"SELECT COUNT(*) FROM {table} {where}", params).fetchone()[0]
+        names = ', '.join(_quote(name) for name in columns)
+        df = pd.read_sql_query(f"SELECT {names} FROM {table} {where} ORDER BY {order} LIMIT ? OFFSET ?", conn, params=params + [limit, offset])
+    finally:
+        conn.close()
+    return _booleans(filename, df), total
+
+
+def has_key(filename, value):
+    """Whether a rule with this exact key is in force; a primary-key lookup, not a table read."""
+    table, key, _ = _table(filename)
+    latest = f" AND {_quote(EFFECTIVE_TO)} IS NULL" if is_versioned(filename) else ""
+    conn = connect()
+    try:
+        return conn.execute(f"SELECT 1 FROM {table} WHERE {_quote(key)} = ?{latest} LIMIT 1", (value,)).fetchone() is not None
+    finally:
+        conn.close()
+
+
+def export_csv(filename):
+    """CSV text of the table including every version, for audit downloads."""
+    return read_history(filename).to_csv(index=False, date_format='%Y-%m-%d')
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+from xlsxwriter.utility import xl_col_to_name
+
+# Strings that worksheet.write() would turn into formulas or links
+_SPECIAL_STRING = r'=|\{=.*\}$|(ftp|http)s?://|mailto:|(in|ex)ternal:'
+
+
+def sheet_formats(workbook):
+    return {
+        'date': workbook.add_format({'num_format': 'yyyy-mm-dd'}),
+        'float': workbook.add_format({'num_format': '#,##0.00'}),
+        'zero': workbook.add_format({'num_format': '-', 'align': 'right'}),
+        'header': workbook.add_format({'bg_color': '#D9E3C0', 'bold': False, 'border': 0}),
+        'header2': workbook.add_format({'bg_color': '#ffff00', 'bold': False, 'border': 0}),
+        'total': workbook.add_format({'num_format': '#,##0.00', 'bg_color': '#ffe6e6', 'bold': True}),
+    }
+
+
+def write_header(worksheet, columns, formats, n_last_columns=0):
+    # The last n_last_columns headers (the computed VAT columns) are highlighted
+    first_highlighted = len(columns) - n_last_columns
+    for col_num, column in enumerate(columns):
+        worksheet.write(0, col_num, column, formats['header2'] if col_num >= first_highlighted else formats['header'])
+
+
+def _write_cell(worksheet, formats, zero_dash, row_num, col_num, value):
+    # Fallback for object columns holding mixed types
+    if isinstance(value, pd.Timestamp):
+        worksheet.write_datetime(row_num, col_num, value, formats['date'])
+    elif isinstance(value, float):
+        if zero_dash and value == 0:
+            worksheet.write(row_num, col_num, value, formats['zero'])
+        else:
+            worksheet.write_number(row_num, col_num, value, formats['float'])
+    else:
+        worksheet.write(row_num, col_num, value)
+
+
+def _column_writer(worksheet, series, formats, zero_dash):
+    kind = series.dtype.kind
+    if kind == 'M':
+        date_format = formats['date']
+        return lambda row_num, col_num, value: worksheet.write_datetime(row_num, col_num, value, date_format)
+    if kind == 'f':
+        float_format = formats['float']
+        if zero_dash:
+            zero_format = formats['zero']
+            return lambda row_num, col_num, value: worksheet.write_number(row_num, col_num, value, zero_format if value == 0 else float_format)
+        return lambda row_num, col_num, value: worksheet.write_number(row_num, col_num, value, float_format)
+    if kind in 'iub':
+        return worksheet.write
+    if pd.api.types.infer_dtype(series, skipna=True) == 'string':
+        # Plain text skips write()'s per-cell formula/URL sniffing; blanks are dropped beforehand
+        text = series.dropna()
+        if not text.str.match(_SPECIAL_STRING).any():
+            return worksheet.write_string
+        return worksheet.write
+    return lambda row_num, col_num, value: _write_cell(worksheet, formats, zero_dash, row_num, col_num, value)
+
+
+def _column_values(series):
+    # Plain Python values with None for blanks, so the row loop never boxes a Series
+    values = series.to_numpy(dtype=object, na_value=None)
+    if series.dtype == object:
+        values[values == ''] = None
+    return values.tolist()
+
+
+def write_rows(worksheet, df, formats, zero_dash=False):
+    """
+    Writes the data rows of df below the header. Column dtypes are inspected once and each
+    column gets a typed writer; blanks are skipped. Rows are emitted in order.
+    """
+    writers = [_column_writer(worksheet, df[column], formats, zero_dash) for column in df.columns]
+    columns = [_column_values(df[column]) for column in df.columns]
+    for row_num, row in enumerate(zip(*columns), start=1):
+        for col_num, value in enumerate(row):
+            if value is not None:
+                writers[col_num](row_num, col_num, value)
+
+
+def write_totals(worksheet, n_rows, first_col, last_col, formats):
+    # SUM of each column from first_col to last_col, on the row below the data
+    rows = n_rows + 1
+    for col_num in range(first_col, last_col + 1):
+        col_name = xl_col_to_name(col_num)
+        worksheet.write_formula(rows, col_num, f'=SUM({col_name}2:{col_name}{rows})', formats['total'])
+
+
+def _text_width(series):
+    kind = series.dtype.kind
+    values = series.dropna()
+    if values.empty:
+        return 0
+    if kind == 'M':
+        return 10  # yyyy-mm-dd
+    if kind == 'f':
+        # Width of '#,##0.00' for the largest magnitude, including the totals row
+        largest = max(values.abs().max(), abs(values.sum()))
+        digits = int(np.floor(np.log10(largest))) + 1 if largest >= 1 else 1
+        return digits + (digits - 1) // 3 + 3 + int((values < 0).any())
+    return int(values.astype(str).str.len().max())
+
+
+def fit_columns(worksheet, df):
+    """Autofit, or in constant_memory mode (where autofit can't see the data) set widths computed from df."""
+    if not worksheet.constant_memory:
+        worksheet.autofit()
+        return
+    for col_num, column in enumerate(df.columns):
+        width = max(len(str(column)), _text_width(df[column]))
+        worksheet.set_column(col_num, col_num, min(width, 255) + 2)
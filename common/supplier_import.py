@@ -0,0 +1,83 @@
+import io
+import pandas as pd
+from common import vat_engine
+
+COLUMNS = ['Supplier Name', 'Service Type', 'Taxes Included']
+KEY = 'Supplier Name'
+
+_TRUE = {'true', 'yes', 'y', '1'}
+_FALSE = {'false', 'no', 'n', '0', ''}
+
+BLANK_NAME = 'Blank Supplier Name'
+UNKNOWN_SERVICE = 'Unknown Service Type'
+BAD_FLAG = 'Taxes Included is not true/false'
+CONFLICT = 'Listed more than once with different values'
+
+
+def read_supplier_file(name, data):
+    """Supplier rows from an uploaded .csv or .xlsx; Taxes Included is optional and defaults to False."""
+    if name.lower().endswith('.csv'):
+        df = pd.read_csv(io.BytesIO(data), dtype=str, keep_default_na=False, encoding='utf-8-sig')
+    else:
+        df = pd.read_excel(io.BytesIO(data), dtype=str, keep_default_na=False)
+    df.columns = df.columns.str.strip()
+    missing = [column for column in COLUMNS[:2] if column not in df.columns]
+    if missing:
+        raise ValueError(f"The file is missing column(s): {', '.join(missing)}")
+    if 'Taxes Included' not in df.columns:
+        df['Taxes Included'] = ''
+    df = df[COLUMNS].apply(lambda column: column.str.strip())
+    return df[(df != '').any(axis=1)].reset_index(drop=True)
+
+
+def plan_import(incoming, current, service_types):
+    """
+    Compares the uploaded suppliers with the current rules, one row per uploaded supplier with an
+    Action (Insert, Update, Unchanged, Conflict or Invalid) and, for updates, the values replaced.
+    """
+    incoming = incoming.copy()
+    flags = incoming['Taxes Included'].str.lower()
+    incoming['Taxes Included'] = flags.isin(_TRUE)
+    incoming['Reason'] = ''
+    incoming.loc[~flags.isin(_TRUE | _FALSE), 'Reason'] = BAD_FLAG
+    incoming.loc[~incoming['Service Type'].isin(service_types), 'Reason'] = UNKNOWN_SERVICE
+    incoming.loc[incoming[KEY] == '', 'Reason'] = BLANK_NAME
+
+    # The same supplier listed with different values cannot be applied either way
+    incoming = incoming.drop_duplicates(subset=COLUMNS)
+    variants = incoming.groupby(KEY)[KEY].transform('size')
+    incoming.loc[(variants > 1) & (incoming['Reason'] == ''), 'Reason'] = CONFLICT
+
+    merged = incoming.merge(current[COLUMNS].drop_duplicates(KEY), on=KEY, how='left', suffixes=('', ' (current)'), indicator=True)
+    changed = ((merged['Service Type'] != merged['Service Type (current)'])
+               | (merged['Taxes Included'] != merged['Taxes Included (current)'].astype(bool)))
+    merged['Action'] = 'Unchanged'
+    merged.loc[merged['_merge'] == 'left_only', 'Action'] = 'Insert'
+    merged.loc[(merged['_merge'] == 'both') & changed, 'Action'] = 'Update'
+    merged.loc[merged['Reason'] == CONFLICT, 'Action'] = 'Conflict'
+    merged.loc[merged['Reason'].isin([BLANK_NAME, UNKNOWN_SERVICE, BAD_FLAG]), 'Action'] = 'Invalid'
+
+    order = ['Action'] + COLUMNS + ['Service Type (current)', 'Taxes Included (current)', 'Reason']
+    return merged[order].sort_values(['Action', KEY], kind='stable', ignore_index=True)
+
+
+def changes(plan):
+    """The rows of a plan that would be written."""
+    return plan.loc[plan['Action'].isin(['Insert', 'Update']), COLUMNS]
+
+
+def plan_sync(juniper_suppliers, current, service_types, aliases=None):
+    """
+    Proposed inserts for Juniper suppliers missing from the mapping, with their Service Type taken
+    from the supplier category. Suppliers already mapped are left alone, so manual rules always win;
+    a supplier counts as mapped when the VAT report would match it (exactly, by alias or normalized).
+    """
+    aliases = aliases if aliases is not None else pd.DataFrame(columns=['Alias', 'Name'])
+    incoming = pd.DataFrame(juniper_suppliers, columns=['Supplier Name', 'Service Type'])
+    incoming = incoming[vat_engine.match_names(incoming[KEY], current[KEY], aliases).isna()]
+    # Spellings of one new supplier that differ only in case, spacing or punctuation are proposed once
+    incoming = incoming[~vat_engine.normalize_names(incoming[KEY]).duplicated()]
+    # Juniper does not say whether a supplier's prices include taxes; review before applying
+    incoming['Taxes Included'] = 'false'
+    plan = plan_import(incoming, current, service_types)
+    return plan[plan['Action'] != 'Unchanged'].reset_index(drop=True)
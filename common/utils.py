@@ -1,16 +1,61 @@
+import os
+import threading
 import pandas as pd
 import streamlit as st
+import streamlit_authenticator as stauth
+import yaml
+from common import rules_store, vat_engine
+
+# Parsed rule tables by path (or store table), as (version, frame); shared by every session
+_rules_cache = {}
+_rules_cache_lock = threading.Lock()
+_rules_cache_stats = {'hits': 0, 'misses': 0}
+
+def _cached_rules(key, version, read):
+    with _rules_cache_lock:
+        cached = _rules_cache.get(key)
+        if cached and cached[0] == version:
+            _rules_cache_stats['hits'] += 1
+            return cached[1].copy()
+        _rules_cache_stats['misses'] += 1
+    df = read()
+    with _rules_cache_lock:
+        _rules_cache[key] = (version, df)
+    return df.copy()
+
+def _read_rules_csv(filename):
+    # Re-parsed only when the file's mtime or size changes; callers get their own copy
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    return _cached_rules(path, (stat.st_mtime_ns, stat.st_size), lambda: pd.read_csv(path))
+
+def _read_rules_table(filename):
+    # Rule tables live in the rules store; its revision counter changes with every write
+    return _cached_rules(('rules_store', os.path.basename(filename)), rules_store.revision(filename), lambda: rules_store.read(filename))
+
+def invalidate_rules_cache(filename=None):
+    with _rules_cache_lock:
+        if filename is None:
+            _rules_cache.clear()
+        else:
+            _rules_cache.pop(os.path.abspath(filename), None)
+
+def rules_cache_info():
+    with _rules_cache_lock:
+        return {**_rules_cache_stats, 'files': len(_rules_cache)}
 
 def load_emirates(filename):
     try:
-        df = pd.read_csv(filename)
+        df = load_rules(filename)
         return df['Emirate'].dropna().unique().tolist()
     except FileNotFoundError:
         return []
     
 def load_rules(filename):
     try:
-        return pd.read_csv(filename)
+        if rules_store.manages(filename):
+            return _read_rules_table(filename)
+        return _read_rules_csv(filename)
     except FileNotFoundError:
         if 'suppliers.csv' in filename:
             return pd.DataFrame(columns=['Supplier Name', 'Service Type', 'Taxes Included'])
@@ -25,13 +70,119 @@ def load_rules(filename):
 
 def load_service_types(filename):
     try:
-        df = pd.read_csv(filename)
+        df = load_rules(filename)
         return df['Service Type'].dropna().unique().tolist()
     except FileNotFoundError:
         return []
     
-def save_rules(rules_df, filename):
-    rules_df.to_csv(filename, index=False)
+def load_rules_history(filename):
+    # Every dated version of a rule table; plain CSVs have a single, always-effective version
+    if rules_store.manages(filename):
+        key = ('rules_store_history', os.path.basename(filename))
+        return _cached_rules(key, rules_store.revision(filename), lambda: rules_store.read_history(filename))
+    return load_rules(filename)
+
+# Built snapshots by the revisions of the tables they were built from
+_snapshots = {}
+
+def load_rules_snapshot():
+    # Read every rule table once so a whole report sees one consistent version
+    files = ['suppliers.csv', 'areas.csv', 'services.csv', 'vat_setup.csv', 'supplier_aliases.csv', 'area_aliases.csv']
+    revisions = tuple(rules_store.revision(filename) for filename in files)
+    with _rules_cache_lock:
+        snapshot = _snapshots.get(revisions)
+    if snapshot is None:
+        snapshot = vat_engine.RulesSnapshot.build(suppliers=load_rules_history('suppliers.csv'),
+                                                  areas=load_rules_history('areas.csv'),
+                                                  services=load_rules('services.csv'),
+                                                  vat=load_rules_history('vat_setup.csv'),
+                                                  supplier_aliases=load_rules('supplier_aliases.csv'),
+                                                  area_aliases=load_rules('area_aliases.csv'))
+        with _rules_cache_lock:
+            _snapshots.clear()
+            _snapshots[revisions] = snapshot
+    return snapshot
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _export_csv(filename, revision):
+    # Serialized once per store revision instead of on every rerun of the rules pages
+    return rules_store.export_csv(filename)
+
+def export_button(filename):
+    st.download_button('⬇️ Export CSV', _export_csv(filename, rules_store.revision(filename)), file_name=filename, mime='text/csv')
+
+def alias_editor(filename, rules_filename, label):
+    # Other spellings that uploads use for a supplier or area name; label is the rule table's key column
+    with st.expander(f"🔗 {label} aliases"):
+        st.dataframe(load_rules(filename), hide_index=True, use_container_width=True)
+        with st.form(key=f'form_{filename}', clear_on_submit=True):
+            alias = st.text_input("Alias (as spelled in uploads)")
+            name = st.text_input(label).strip()
+            if st.form_submit_button("💾 Save alias"):
+                if alias.strip() == "":
+                    st.error("Alias cannot be empty.")
+                elif not rules_store.has_key(rules_filename, name):
+                    # A few close spellings instead of sending every name to the browser as options
+                    matches, _ = rules_store.query(rules_filename, search=name, column=label, sort=label, limit=5)
+                    hint = f" Did you mean: {', '.join(matches[label])}?" if name and not matches.empty else ""
+                    st.error(f"No {label} '{name}' in the rules.{hint}")
+                else:
+                    rules_store.upsert(filename, {'Alias': alias.strip(), 'Name': name})
+                    st.toast("Saved!")
+                    st.rerun()
+
+def compact_frame(df, columns):
+    # Repeated strings (currency, tax code, customer...) are stored once per distinct value
+    df = df.copy()
+    for column in columns:
+        if column in df.columns and df[column].dtype == object:
+            df[column] = df[column].astype('category')
+    return df
+
+def frame_memory(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+def session_memory_report():
+    rows = []
+    for key, value in st.session_state.items():
+        if isinstance(value, pd.DataFrame):
+            size = frame_memory(value)
+        elif isinstance(value, (bytes, str)):
+            size = len(value)
+        else:
+            continue
+        rows.append({'Key': key, 'Type': type(value).__name__, 'Size (KB)': round(size / 1024, 1)})
+    report = pd.DataFrame(rows, columns=['Key', 'Type', 'Size (KB)'])
+    return report.sort_values('Size (KB)', ascending=False, ignore_index=True)
+
+def show_memory_report():
+    report = session_memory_report()
+    with st.expander(f"Session memory: {report['Size (KB)'].sum() / 1024:,.1f} MB"):
+        st.dataframe(report, hide_index=True, use_container_width=True)
+
+@st.cache_data(show_spinner=False)
+def _auth_config(mtime):
+    # Parsed once per config.yaml edit; each caller gets its own copy, which Authenticate mutates
+    with open('./common/config.yaml') as file:
+        return yaml.load(file, Loader=yaml.SafeLoader)
+
+def get_authenticator():
+    """The session's Authenticate, built on first use instead of on every rerun of every page."""
+    authenticator = st.session_state.get('authenticator')
+    if authenticator is None:
+        config = _auth_config(os.path.getmtime('./common/config.yaml'))
+        authenticator = stauth.Authenticate(
+            config['credentials'],
+            config['cookie']['name'],
+            config['cookie']['key'],
+            config['cookie']['expiry_days'],
+            config['pre-authorized']
+        )
+        st.session_state['authenticator'] = authenticator
+    elif not st.session_state.get('authentication_status'):
+        # The cookie component only reports back on a later rerun; keep reading it until logged in
+        authenticator.cookie_handler.cookie_manager.get_all(key='init')
+    return authenticator
 
 def hide_home_page():
 
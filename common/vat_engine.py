@@ -0,0 +1,377 @@
+import hashlib
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from itertools import repeat
+import numpy as np
+import pandas as pd
+
+
+def _frame_digest(df):
+    digest = hashlib.sha256(repr(list(df.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+# Rule rows carry the dates they apply between; rules without them apply to every date
+EFFECTIVE_FROM = 'Effective From'
+EFFECTIVE_TO = 'Effective To'
+
+
+def _with_effective_dates(df, key):
+    df = df.copy()
+    if EFFECTIVE_FROM not in df.columns:
+        df[EFFECTIVE_FROM] = pd.NaT
+    if EFFECTIVE_TO not in df.columns:
+        df[EFFECTIVE_TO] = pd.NaT
+    # merge_asof needs both sides in the same unit; uploads may carry other units than ns
+    df[EFFECTIVE_FROM] = pd.to_datetime(df[EFFECTIVE_FROM]).astype('datetime64[ns]').fillna(pd.Timestamp.min)
+    df[EFFECTIVE_TO] = pd.to_datetime(df[EFFECTIVE_TO]).astype('datetime64[ns]')
+    # First rule wins for a key and start date, as with the row-by-row lookups these replace
+    df = df.drop_duplicates([key, EFFECTIVE_FROM])
+    return df.sort_values(EFFECTIVE_FROM, kind='stable', ignore_index=True)
+
+
+def _as_of(rules, key, keys, dates):
+    """
+    The rule row in force for each (key, date) pair, aligned with keys, using one as-of join.
+    A blank date takes the latest rule. Pairs with no rule in force get NaN and _matched False.
+    """
+    left = pd.DataFrame({'_key': keys.to_numpy(dtype=object),
+                         '_date': pd.to_datetime(dates).astype('datetime64[ns]').fillna(pd.Timestamp.max).to_numpy(),
+                         '_position': np.arange(len(keys))})
+    left = left.sort_values('_date', kind='stable')
+    right = rules.rename(columns={key: '_key'}).astype({'_key': object})
+    merged = pd.merge_asof(left, right, left_on='_date', right_on=EFFECTIVE_FROM, by='_key', direction='backward')
+    merged['_matched'] = merged[EFFECTIVE_FROM].notna() & ~(merged[EFFECTIVE_TO] <= merged['_date'])
+    merged = merged.sort_values('_position').set_index(keys.index)
+    values = [column for column in rules.columns if column not in (key, EFFECTIVE_FROM, EFFECTIVE_TO)]
+    if not merged['_matched'].all():
+        # Boolean rule columns become object first so they can hold the NaN
+        flags = [column for column in values if merged[column].dtype == bool]
+        merged[flags] = merged[flags].astype(object)
+        merged[values] = merged[values].where(merged['_matched'])
+    return merged[values + ['_matched']]
+
+
+def normalize_names(names):
+    """Case-folded names with punctuation dropped and whitespace collapsed, e.g. ' Al-Barsha ' -> 'al barsha'."""
+    unique = pd.Series(names.dropna().unique(), dtype=object)
+    normalized = (unique.astype(str).str.casefold()
+                  .str.replace(r'[^\w\s]', ' ', regex=True)
+                  .str.replace(r'\s+', ' ', regex=True)
+                  .str.strip())
+    # Computed once per distinct name, then broadcast to every row
+    return names.map(pd.Series(normalized.to_numpy(), index=unique.to_numpy()))
+
+
+def _name_index(keys, aliases):
+    # Normalized alias -> rule key and normalized rule key -> rule key; the first entry wins on clashes
+    keys = pd.Series(pd.unique(keys.dropna()), dtype=object)
+    by_normalized = pd.Series(keys.to_numpy(), index=normalize_names(keys).to_numpy())
+    by_alias = pd.Series(aliases['Name'].to_numpy(dtype=object), index=normalize_names(aliases['Alias']).to_numpy())
+    return (frozenset(keys),
+            by_alias[~by_alias.index.duplicated()],
+            by_normalized[~by_normalized.index.duplicated()])
+
+
+def _resolve_names(names, index):
+    """
+    The rule key each name refers to, and how it was found: Exact, Alias or Normalized.
+    Exact spellings win over aliases, and aliases over normalized matches.
+    """
+    exact, by_alias, by_normalized = index
+    normalized = normalize_names(names)
+    alias = normalized.map(by_alias)
+    fuzzy = normalized.map(by_normalized)
+    is_exact = names.isin(exact)
+    resolved = names.where(is_exact, alias.where(alias.notna(), fuzzy))
+    match = np.select([is_exact.to_numpy(), alias.notna().to_numpy(), fuzzy.notna().to_numpy()],
+                      ['Exact', 'Alias', 'Normalized'], default='')
+    return resolved, pd.Series(match, index=names.index)
+
+
+def match_names(names, keys, aliases):
+    """The rule key each of names refers to (NaN if none), found the same way report rows are matched."""
+    return _resolve_names(names, _name_index(keys, aliases))[0]
+
+
+def _match_report(kind, names, resolved, match):
+    rows = pd.DataFrame({'Kind': kind, 'Name': names, 'Matched': resolved, 'Match': match})
+    rows = rows[rows['Match'].isin(['Alias', 'Normalized'])]
+    return rows.groupby(['Kind', 'Name', 'Matched', 'Match'], sort=True).size().reset_index(name='Rows')
+
+
+@dataclass(frozen=True)
+class RulesSnapshot:
+    """
+    The supplier, area, service and VAT rules one report is computed from, including every dated
+    version, sorted for as-of lookups. Treat the frames as read-only; build a new snapshot to pick up edits.
+    """
+    suppliers: pd.DataFrame
+    areas: pd.DataFrame
+    services: pd.DataFrame
+    vat: pd.DataFrame
+    supplier_names: tuple
+    area_names: tuple
+    version: str
+
+    @classmethod
+    def build(cls, suppliers, areas, services, vat, supplier_aliases=None, area_aliases=None):
+        supplier_aliases = supplier_aliases if supplier_aliases is not None else pd.DataFrame(columns=['Alias', 'Name'])
+        area_aliases = area_aliases if area_aliases is not None else pd.DataFrame(columns=['Alias', 'Name'])
+        digest = hashlib.sha256()
+        for frame in (suppliers, areas, services, vat, supplier_aliases, area_aliases):
+            digest.update(_frame_digest(frame).encode())
+        return cls(suppliers=_with_effective_dates(suppliers, 'Supplier Name'),
+                   areas=_with_effective_dates(areas, 'Area'),
+                   services=services,
+                   vat=_with_effective_dates(vat, 'Emirate'),
+                   supplier_names=_name_index(suppliers['Supplier Name'], supplier_aliases),
+                   area_names=_name_index(areas['Area'], area_aliases),
+                   version=digest.hexdigest()[:12])
+
+    def supplier_rules(self, df):
+        names, _ = _resolve_names(df['Supplier name'], self.supplier_names)
+        return _as_of(self.suppliers, 'Supplier Name', names, df['Start date'])
+
+    def area_rules(self, df):
+        names, _ = _resolve_names(df['Area name'], self.area_names)
+        return _as_of(self.areas, 'Area', names, df['Start date'])
+
+    def match_report(self, df):
+        """Upload names found through an alias or normalization rather than their exact spelling."""
+        reports = [_match_report(kind, df[column], *_resolve_names(df[column], index))
+                   for kind, column, index in [('Supplier', 'Supplier name', self.supplier_names),
+                                               ('Area', 'Area name', self.area_names)]]
+        return pd.concat(reports, ignore_index=True)
+
+    def vat_rates(self, df):
+        return _as_of(self.vat, 'Emirate', df['Emirate'], df['Start date'])
+
+
+def classify_rows(df, rules):
+    """
+    Adds Service Type, Emirate and Country to the transactions by joining on the supplier
+    and area rules in force on each Start date. Returns the classified frame, the undefined
+    suppliers and the unknown areas.
+    """
+    supplier = rules.supplier_rules(df)
+    area = rules.area_rules(df)
+    known_supplier = supplier['_matched']
+    known_area = area['_matched']
+
+    df = df.copy()
+    df['Service Type'] = supplier['Service Type']
+    df['Emirate'] = area['Emirate'].where(known_area, 'NA')
+    df['Country'] = np.where(known_area, 'UAE', 'ROW')
+
+    supplier_not_found = set(df.loc[~known_supplier, 'Supplier name'])
+    area_not_found = set(df.loc[~known_area, 'Area name'])
+    return df, supplier_not_found, area_not_found
+
+
+def _taxes_included(df, rules):
+    # A blank flag counts as included, as it did when tested with a plain `if`
+    return rules.supplier_rules(df)['Taxes Included'].astype(bool).to_numpy()
+
+
+def _emirate_rates(df, rules):
+    return rules.vat_rates(df)
+
+
+def compute_hotel_vat(df, rules):
+    """Input and output VAT columns for UAE hotel rows (HR TAX)."""
+    tax_included = _taxes_included(df, rules)
+    rates = _emirate_rates(df, rules)
+    bd_amt = rates['Basic Division'].to_numpy()
+    sc_pct = rates['Service Charge'].to_numpy()
+    mf_pct = rates['Municipality Fee'].to_numpy()
+    vat_pct = rates['VAT Percentage'].to_numpy()
+    cost = df['Final base cost in base currency'].to_numpy(dtype=float)
+    sales = df['Final base sales in base currency'].to_numpy(dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        basic = np.where(tax_included, 0.0, cost / bd_amt)
+        service_charge = np.where(tax_included, 0.0, basic * (sc_pct / 100))
+        municipality_fee = np.where(tax_included, 0.0, basic * (mf_pct / 100))
+        vat_paid = np.where(tax_included, 0.0, (basic + service_charge) * (vat_pct / 100))
+        taxable_input = np.where(tax_included, 0.0, vat_paid / (vat_pct / 100))
+        total_vat = sales / (100 + vat_pct) * vat_pct
+        taxable_output = total_vat / (vat_pct / 100)
+
+    return df.assign(**{
+        'Basic': basic,
+        'Service Charge': service_charge,
+        'Municipality Fee': municipality_fee,
+        'VAT Paid': vat_paid,
+        'Taxable value input': taxable_input,
+        'Total VAT': total_vat,
+        'Taxable value output': taxable_output,
+        'Net VAT payable': total_vat - vat_paid,
+    })
+
+
+def compute_excursion_vat(df, rules):
+    """Input and output VAT columns for UAE excursion rows (EX TAX)."""
+    tax_included = _taxes_included(df, rules)
+    vat_pct = _emirate_rates(df, rules)['VAT Percentage'].to_numpy()
+    cost = df['Final base cost in base currency'].to_numpy(dtype=float)
+    sales = df['Final base sales in base currency'].to_numpy(dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vat_paid = np.where(tax_included, 0.0, cost / (100 + vat_pct) * vat_pct)
+        taxable_input = np.where(tax_included, 0.0, vat_paid / (vat_pct / 100))
+        vat_output = sales / (100 + vat_pct) * vat_pct
+        taxable_output = vat_output / (vat_pct / 100)
+
+    return df.assign(**{
+        'VAT Paid': vat_paid,
+        'Taxable value input': taxable_input,
+        'Profit': sales - cost,
+        'VAT Output': vat_output,
+        'Taxable value output': taxable_output,
+        'Net VAT payable': vat_output - vat_paid,
+    })
+
+
+def compute_visa_vat(df):
+    """Visa rows carry no recoverable or output VAT; the columns are laid out as zeros."""
+    zeros = np.zeros(len(df))
+    return df.assign(**{
+        'Basic Charges': zeros,
+        'Service Charges': zeros,
+        'Naqoodi Charges': zeros,
+        'VAT Paid': zeros,
+        'Reconciled': zeros,
+        'Taxable Value Input': zeros,
+        'VAT Output': zeros,
+        'Taxable Value Output': zeros,
+        'VAT payable': zeros,
+    })
+
+
+# Tourism Dirham Fee lines are reported on OTHER NA whatever their service type
+TDF_DESCRIPTIONS = ["TDF", "COVER TDF", "COVERING TDF"]
+
+SHEETS = ['HR TAX', 'HR ZERO', 'EX TAX', 'EX ZERO', 'AIR TICKET', 'VISA', 'OTHER NA']
+UNASSIGNED = 'UNASSIGNED'
+
+
+def assign_sheets(df):
+    """Tags every classified row with the one sheet it is reported on."""
+    service_type = df['Service Type']
+    uae = (df['Country'] == 'UAE').to_numpy()
+    row = (df['Country'] == 'ROW').to_numpy()
+    hotel = (service_type == 'Hotel Reservation').to_numpy()
+    excursion = (service_type == 'Excursion').to_numpy()
+    tdf = df['Description'].astype('string').str.upper().isin(TDF_DESCRIPTIONS).to_numpy(dtype=bool)
+
+    # First matching condition wins
+    conditions = [
+        tdf | (service_type == 'Other').to_numpy(),
+        (service_type == 'Air Ticket').to_numpy(),
+        uae & hotel,
+        row & hotel,
+        uae & excursion,
+        row & excursion,
+        uae & (service_type == 'Visa').to_numpy(),
+    ]
+    choices = ['OTHER NA', 'AIR TICKET', 'HR TAX', 'HR ZERO', 'EX TAX', 'EX ZERO', 'VISA']
+    sheet = np.select(conditions, choices, default=UNASSIGNED)
+    return df.assign(Sheet=pd.Categorical(sheet, categories=SHEETS + [UNASSIGNED]))
+
+
+def split_sheets(df):
+    """Partitions the tagged rows by sheet, keeping upload order within each sheet."""
+    parts = dict(tuple(df.groupby('Sheet', observed=True, sort=False)))
+    return {name: parts.get(name, df.iloc[0:0]) for name in SHEETS + [UNASSIGNED]}
+
+
+BASE_COLUMNS = ['Country',
+                'Emirate',
+                'Area name',
+                'Booking code',
+                'No. of nights',
+                'Start date',
+                'End date',
+                'Supplier name',
+                'Description',
+                'Product group',
+                'Product Type',
+                'Service Type',
+                'Final base sales in base currency',
+                'Final base cost in base currency']
+
+SHEET_COLUMNS = {
+    'HR TAX': BASE_COLUMNS + ['Basic',
+                              'Service Charge',
+                              'VAT Paid',
+                              'Taxable value input',
+                              'Taxable value output',
+                              'Total VAT',
+                              'Net VAT payable'],
+    'HR ZERO': BASE_COLUMNS,
+    'EX TAX': BASE_COLUMNS + ['Profit',
+                              'VAT Paid',
+                              'Taxable value input',
+                              'VAT Output',
+                              'Taxable value output',
+                              'Net VAT payable'],
+    'EX ZERO': BASE_COLUMNS,
+    'AIR TICKET': BASE_COLUMNS,
+    'VISA': BASE_COLUMNS + ['Basic Charges',
+                            'Service Charges',
+                            'Naqoodi Charges',
+                            'VAT Paid',
+                            'Reconciled',
+                            'Taxable Value Input',
+                            'VAT Output',
+                            'Taxable Value Output',
+                            'VAT payable'],
+    'OTHER NA': BASE_COLUMNS,
+}
+
+# The sheet math is vectorized, so spawning workers and pickling the partitions only pays off
+# on very large uploads (at 300k rows the pool was still ~10x slower than serial)
+PARALLEL_ROW_THRESHOLD = 1000000
+
+
+def prepare_sheet(name, df, rules):
+    """VAT math, column layout and ordering for one sheet's partition, ready to be written."""
+    if name == 'HR TAX':
+        df = compute_hotel_vat(df, rules)
+    elif name == 'EX TAX':
+        df = compute_excursion_vat(df, rules)
+    elif name == 'VISA':
+        df = compute_visa_vat(df)
+
+    df = df[SHEET_COLUMNS[name]]
+    if name in ('HR TAX', 'EX TAX', 'VISA'):
+        df = df.sort_values(by=['Emirate', 'Supplier name'], ascending=[True, True])
+    if name == 'EX TAX':
+        df = df.rename(columns={'Final base sales in base currency': 'Final Sale', 'Final base cost in base currency': 'Final Cost'})
+    return df
+
+
+def prepare_sheets(sheets, rules, parallel=None):
+    """
+    Prepares every sheet frame, in a process pool for large reports. Results come back in
+    SHEETS order either way; if the pool cannot be used the sheets are prepared serially.
+    """
+    if parallel is None:
+        parallel = sum(len(sheets[name]) for name in SHEETS) >= PARALLEL_ROW_THRESHOLD
+
+    if parallel:
+        try:
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=min(len(SHEETS), os.cpu_count() or 1), mp_context=context) as pool:
+                frames = pool.map(prepare_sheet, SHEETS, [sheets[name] for name in SHEETS], repeat(rules))
+                return dict(zip(SHEETS, frames))
+        except (BrokenProcessPool, OSError, pickle.PicklingError):
+            pass
+
+    return {name: prepare_sheet(name, sheets[name], rules) for name in SHEETS}
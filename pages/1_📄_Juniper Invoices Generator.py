@@ -1,42 +1,20 @@
 import streamlit as st
 import pandas as pd
-import streamlit_authenticator as stauth
-import yaml
-from yaml.loader import SafeLoader
-from common import juniper_api, utils
+from common import exports, jobs, juniper_api, preview, utils
+
+# Repeated string columns kept as categoricals in session state
+CATEGORY_COLUMNS = ["InvoiceDate", "Service Date", "Currency", "CustomerName", "Tax Code", "Service", "Account Manager", "Payment Terms", "Location"]
 
 
 def save_csv_files(df, start_date_str, end_date_str):
     # Exclude rows with negative amounts
     df_positive = df[df["Item Amount"] >= 0]
-    
-    # Group by invoice number
-    grouped = df_positive.groupby("Invoice No")
-    
-    # Create chunks
-    chunk_size = 4000
-    current_chunk = []
-    chunks = []
-    current_size = 0
-    
-    for name, group in grouped:
-        group_size = len(group)
-        if current_size + group_size > chunk_size:
-            chunks.append(pd.concat(current_chunk))
-            current_chunk = []
-            current_size = 0
-        current_chunk.append(group)
-        current_size += group_size
-    
-    if current_chunk:
-        chunks.append(pd.concat(current_chunk))
-    
+
     csv_files = []
-    for idx, chunk in enumerate(chunks):
+    for idx, chunk in enumerate(exports.split_chunks(df_positive, "Invoice No")):
         file_name = f'invoices_{start_date_str}_{end_date_str}_part{idx+1}.csv'
-        chunk_csv = chunk.to_csv(index=False)
-        csv_files.append((file_name, chunk_csv))
-    
+        csv_files.append((file_name, chunk))
+
     return csv_files
 
 def save_credit_memo_files(df, start_date_str, end_date_str):
@@ -48,101 +26,170 @@ def save_credit_memo_files(df, start_date_str, end_date_str):
     credit_memo_df["Taxes"] = credit_memo_df["Taxes"].abs()
 
     if not credit_memo_df.empty:
-        # Define file name and convert DataFrame to CSV
         credit_memo_file_name = f'credit_memo_{start_date_str}_{end_date_str}.csv'
-        credit_memo_csv = credit_memo_df.to_csv(index=False)
-        return credit_memo_file_name, credit_memo_csv
+        return credit_memo_file_name, credit_memo_df
 
     return None, None
 
+def save_files(df, start_date_str, end_date_str):
+    # Every invoice part plus the credit memo file, as (file name, frame); nothing is written yet
+    parts = save_csv_files(df, start_date_str, end_date_str)
+    credit_memo_file_name, credit_memo_df = save_credit_memo_files(df, start_date_str, end_date_str)
+    if credit_memo_file_name:
+        parts.append((credit_memo_file_name, credit_memo_df))
+    return parts
+
+
+def run_invoice_fetch(invoice_date_from_str, invoice_date_to_str, incremental, progress):
+    # Runs in the background job pool; returns everything the page needs to show the result
+    progress("Loading suppliers")
+    juniper_api.fetch_and_populate_suppliers()
+
+    changes = None
+    if incremental:
+        invoice_count, invoice_item_count, df, changes = juniper_api.fetch_invoices_incremental(invoice_date_from_str, invoice_date_to_str, progress)
+    else:
+        invoice_count, invoice_item_count, df = juniper_api.fetch_invoices(invoice_date_from_str, invoice_date_to_str, progress)
+    if df.empty:
+        return None
+
+    df.index = range(1, len(df) + 1)
+    return {
+        "df": utils.compact_frame(df, CATEGORY_COLUMNS),
+        "invoice_period": (invoice_date_from_str, invoice_date_to_str),
+        "invoice_fingerprint": exports.fingerprint(df),
+        "invoice_count": invoice_count,
+        "invoice_item_count": invoice_item_count,
+        "invoice_changes": changes,
+    }
+
+@st.experimental_fragment(run_every=1)
+def fetch_progress():
+    # Only the progress bar redraws while the job runs; a full rerun picks up the result
+    job = jobs.get(st.session_state.invoice_job_id)
+    if job is None or not job.running:
+        st.rerun()
+    st.progress(job.fraction, text=f"{job.stage or 'Starting'}... {job.done}/{job.total}" if job.total else f"{job.stage or 'Starting'}...")
+    if st.button('✖ Cancel'):
+        job.cancel()
+
+def show_fetch_job():
+    job = jobs.get(st.session_state.invoice_job_id)
+    if job is None:
+        st.session_state.invoice_job_id = None
+        return
+
+    if job.running:
+        fetch_progress()
+        return
+
+    st.session_state.invoice_job_id = None
+    jobs.discard(job.id)
+    if job.status == "cancelled":
+        st.warning("Fetch cancelled.")
+    elif job.status == "failed":
+        st.error(f"Fetch failed: {job.error}")
+    elif job.result is None:
+        st.warning("No invoices found for this period.")
+    else:
+        for key, value in job.result.items():
+            st.session_state[key] = value
+
+@st.experimental_fragment
+def fetch_controls():
+    # Date and checkbox changes rerun only these controls
+    invoice_date_from = st.date_input("Invoice Date From")
+    invoice_date_to = st.date_input("Invoice Date To", value=invoice_date_from)
+
+    # Validation checks
+    if invoice_date_from and invoice_date_to:
+        same_month = invoice_date_from.month == invoice_date_to.month
+        if not same_month:
+            st.error("The period must be within the same month.")
+        else:
+            invoice_date_from_str = invoice_date_from.strftime("%Y%m%d")
+            invoice_date_to_str = invoice_date_to.strftime("%Y%m%d")
+            incremental = False
+            if juniper_api.has_previous_fetch('invoices', invoice_date_from_str, invoice_date_to_str):
+                incremental = st.checkbox("Only fetch changes since the last run of this period", value=True)
+            if st.button('Fetch Invoices', disabled=st.session_state.invoice_job_id is not None):
+                job = jobs.submit('invoices', run_invoice_fetch, invoice_date_from_str, invoice_date_to_str, incremental)
+                st.session_state.invoice_job_id = job.id
+                # The progress bar lives outside this fragment
+                st.rerun()
+
+@st.experimental_fragment
+def fetch_results():
+    # Filtering, sorting and paging the preview rerun only this section
+    if st.session_state.invoice_count:
+        st.write(f"Number of invoices: {st.session_state.invoice_count}")
+    if st.session_state.invoice_item_count:
+        st.write(f"Number of invoice items: {st.session_state.invoice_item_count}")
+    if st.session_state.invoice_changes is not None:
+        with st.expander(f"Changes since last run: {len(st.session_state.invoice_changes)}"):
+            st.dataframe(st.session_state.invoice_changes, hide_index=True, use_container_width=True)
+    if not st.session_state.df.empty:
+        preview.paged_preview(st.session_state.df, key="df_preview", total_columns=("Item Amount", "Taxes"))
+        utils.show_memory_report()
+
+@st.experimental_fragment
+def downloads():
+    # A file is only built once it is picked, then served from the shared artifact cache
+    start_date_str, end_date_str = st.session_state.invoice_period
+    parts = dict(save_files(st.session_state.df, start_date_str, end_date_str))
+    zip_file_name = f'invoices_{start_date_str}_{end_date_str}.zip'
+    file_name = st.selectbox("File to download", options=list(parts) + [zip_file_name], index=None, placeholder="Choose a file")
+    if file_name is None:
+        return
+
+    key = ('invoices', start_date_str, end_date_str, st.session_state.invoice_fingerprint, file_name)
+    with st.spinner(f'Preparing {file_name}...'):
+        if file_name == zip_file_name:
+            data = exports.artifact(key, lambda: exports.write_zip(parts.items()))
+        else:
+            data = exports.artifact(key, lambda: exports.write_csv(parts[file_name]))
+    st.download_button(
+        label=f"📥 Download {file_name}",
+        data=data,
+        file_name=file_name,
+        mime='application/zip' if file_name == zip_file_name else 'text/csv',
+    )
 
 def qb_invoices():
     pd.options.mode.copy_on_write = True
     title = 'Juniper Invoices Generator'
     st.markdown(f"<h1 style='font-size:24px;'>{title}</h1>", unsafe_allow_html=True)
 
-    invoice_date_from = st.date_input("Invoice Date From")
-    invoice_date_to = st.date_input("Invoice Date To", value=invoice_date_from)
-
-
-    if "csv_files" not in st.session_state:
-        st.session_state.csv_files = []
-    if "credit_memo_file" not in st.session_state:
-        st.session_state.credit_memo_file = None
+    if "invoice_fingerprint" not in st.session_state:
+        st.session_state.invoice_fingerprint = None
+    if "invoice_period" not in st.session_state:
+        st.session_state.invoice_period = None
     if "invoice_count" not in st.session_state:
         st.session_state.invoice_count = 0
     if "invoice_item_count" not in st.session_state:
         st.session_state.invoice_item_count = 0
     if "df" not in st.session_state:
         st.session_state.df = pd.DataFrame()
+    if "invoice_job_id" not in st.session_state:
+        st.session_state.invoice_job_id = None
+    if "invoice_changes" not in st.session_state:
+        st.session_state.invoice_changes = None
 
-    # Validation checks
-    if invoice_date_from and invoice_date_to:
-        same_month = invoice_date_from.month == invoice_date_to.month
-        if not same_month:
-            st.error("The period must be within the same month.")
-        else:
-            if st.button('Fetch Invoices'):
-                with st.spinner('Fetching invoices...'):
-                    invoice_date_from_str = invoice_date_from.strftime("%Y%m%d")
-                    invoice_date_to_str = invoice_date_to.strftime("%Y%m%d")
-                    juniper_api.fetch_and_populate_suppliers()
-
-                    invoice_count, invoice_item_count, df = juniper_api.fetch_invoices(invoice_date_from_str, invoice_date_to_str)
-
-                    if not df.empty:
-                        df.index = range(1, len(df) + 1)
-                        st.session_state.csv_files = save_csv_files(df, invoice_date_from_str, invoice_date_to_str)
-                        st.session_state.invoice_count = invoice_count
-                        st.session_state.invoice_item_count = invoice_item_count
-                        st.session_state.df = df
-
-                        # Save credit memo files
-                        credit_memo_file_name, credit_memo_csv = save_credit_memo_files(df, invoice_date_from_str, invoice_date_to_str)
-                        if credit_memo_csv:
-                            st.session_state.credit_memo_file = (credit_memo_file_name, credit_memo_csv)
-                        else:
-                            st.session_state.credit_memo_file = None
+    fetch_controls()
+
+    if st.session_state.invoice_job_id:
+        show_fetch_job()
+
+    fetch_results()
 
-    if st.session_state.invoice_count:
-        st.write(f"Number of invoices: {st.session_state.invoice_count}")
-    if st.session_state.invoice_item_count:
-        st.write(f"Number of invoice items: {st.session_state.invoice_item_count}")
     if not st.session_state.df.empty:
-        st.write(st.session_state.df)
-    
-    if st.session_state.csv_files:
-        for file_name, csv in st.session_state.csv_files:
-            st.download_button(
-                label=f"📥 Download {file_name}",
-                data=csv,
-                file_name=file_name,
-                mime='text/csv',
-            )
-    
-    if st.session_state.credit_memo_file:
-        file_name, csv = st.session_state.credit_memo_file
-        st.download_button(
-            label=f"📥 Download {file_name}",
-            data=csv,
-            file_name=file_name,
-            mime='text/csv',
-        )
+        downloads()
 
 utils.hide_home_page()
 utils.add_logo()
 
 
-with open('./common/config.yaml') as file:
-    config = yaml.load(file, Loader=SafeLoader)
-
-authenticator = stauth.Authenticate(
-    config['credentials'],
-    config['cookie']['name'],
-    config['cookie']['key'],
-    config['cookie']['expiry_days'],
-    config['pre-authorized']
-)
+authenticator = utils.get_authenticator()
 
 authenticator.login(max_login_attempts=5, clear_on_submit=True)
 
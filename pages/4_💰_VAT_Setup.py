@@ -1,25 +1,14 @@
 import streamlit as st
-import pandas as pd
-from st_aggrid import AgGrid, GridOptionsBuilder
-import yaml
-from yaml.loader import SafeLoader
-import streamlit_authenticator as stauth
-from common import utils
+from common import preview, rules_store, utils
 
 
 def vat_setup_editor(filename):
     title = "VAT Setup"
     st.markdown(f"<h3 style='font-size:24px;'>{title}</h3>", unsafe_allow_html=True)
-    rules_df = utils.load_rules(filename)
-    if rules_df.empty:
-        rules_df = pd.DataFrame(columns=['Emirate', 'Basic Division', 'Service Charge', 'Municipality Fee', 'VAT Percentage'])
 
-    # Ag-Grid implementation
-    grid_options = GridOptionsBuilder.from_dataframe(rules_df)
-    grid_options.configure_pagination(paginationAutoPageSize=True)
-    grid_options.configure_side_bar(False, False)
-    grid_options.configure_selection('single')
-    AgGrid(rules_df, gridOptions=grid_options.build(), update_mode='MODEL_CHANGED', fit_columns_on_grid_load=True)
+    # Only the visible page is read from the rules store and sent to the grid
+    preview.rules_grid(filename, key='vat_setup_rules')
+    utils.export_button(filename)
 
 
     # Add or update rule
@@ -29,28 +18,18 @@ def vat_setup_editor(filename):
         new_sc = st.number_input("Service Charge", format="%.2f")
         new_mf = st.number_input("Municipality Fee", format="%.2f")
         new_vat = st.number_input("VAT Percentage", format="%.2f")
+        new_from = st.date_input("Effective from", value=None, help="Leave blank to correct the current rule; set a date to start a new version from then")
 
         submitted = st.form_submit_button("💾 Save")
         if submitted:
-            new_row = pd.DataFrame([{'Emirate': new_emirate, 'Basic Division': new_bd, 'Service Charge': new_sc, 'Municipality Fee': new_mf, 'VAT Percentage': new_vat}])
-            rules_df = pd.concat([rules_df, new_row]).drop_duplicates(subset=['Emirate'], keep='last')
-            utils.save_rules(rules_df, filename)
-            st.success("Saved!")
+            rules_store.upsert(filename, {'Emirate': new_emirate, 'Basic Division': new_bd, 'Service Charge': new_sc, 'Municipality Fee': new_mf, 'VAT Percentage': new_vat}, effective_from=new_from)
+            st.toast("Saved!")
             st.rerun()
 
 utils.hide_home_page()
 utils.add_logo()
 
-with open('./common/config.yaml') as file:
-    config = yaml.load(file, Loader=SafeLoader)
-
-authenticator = stauth.Authenticate(
-    config['credentials'],
-    config['cookie']['name'],
-    config['cookie']['key'],
-    config['cookie']['expiry_days'],
-    config['pre-authorized']
-)
+authenticator = utils.get_authenticator()
 
 authenticator.login(max_login_attempts=5, clear_on_submit=True)
 
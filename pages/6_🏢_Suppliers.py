@@ -1,10 +1,6 @@
 import streamlit as st
 import pandas as pd
-from st_aggrid import AgGrid, GridOptionsBuilder
-import yaml
-from yaml.loader import SafeLoader
-import streamlit_authenticator as stauth
-from common import utils
+from common import juniper_api, preview, rules_store, supplier_import, utils
 
     
 def product_supplier_editor(filename):
@@ -17,44 +13,90 @@ def product_supplier_editor(filename):
     # Load service types for dropdown
     service_types = utils.load_service_types('services.csv')
 
-    # Ag-Grid implementation
-    grid_options = GridOptionsBuilder.from_dataframe(rules_df)
-    grid_options.configure_pagination(paginationPageSize=10)
-    grid_options.configure_side_bar(False, False)
-    grid_options.configure_selection('single')
-    AgGrid(rules_df, gridOptions=grid_options.build(), update_mode='MODEL_CHANGED', fit_columns_on_grid_load=True)
+    # Only the visible page is read from the rules store and sent to the grid
+    preview.rules_grid(filename, key='suppliers_rules')
+    utils.export_button(filename)
     
     # Add or update rule
     with st.form(key='form_product_supplier', clear_on_submit=True):
         new_supplier = st.text_input("Supplier Name")
         new_service_type = st.selectbox("Service Type", options=service_types)
         new_tax = st.checkbox("Taxes Included")
+        new_from = st.date_input("Effective from", value=None, help="Leave blank to correct the current rule; set a date to start a new version from then")
     
         submitted = st.form_submit_button("💾 Save")
         if submitted:
             if new_supplier.strip() == "":
                 st.error("Supplier Name cannot be empty.")
             else:
-                new_row = pd.DataFrame([{'Supplier Name': new_supplier, 'Service Type': new_service_type, 'Taxes Included': new_tax}])
-                rules_df = pd.concat([rules_df, new_row]).drop_duplicates(subset=['Supplier Name'], keep='last')
-                utils.save_rules(rules_df, filename)
-                st.success("Saved!")
+                rules_store.upsert(filename, {'Supplier Name': new_supplier, 'Service Type': new_service_type, 'Taxes Included': new_tax}, effective_from=new_from)
+                st.toast("Saved!")
                 st.rerun()
 
+    bulk_import(filename, rules_df, service_types)
+    juniper_sync(filename, rules_df, service_types)
+    utils.alias_editor('supplier_aliases.csv', filename, "Supplier Name")
+
+
+def review_and_apply(filename, plan, key):
+    # Counts, the full diff, then one transaction for the inserts and updates
+    counts = plan['Action'].value_counts()
+    metrics = st.columns(5)
+    for metric, action in zip(metrics, ['Insert', 'Update', 'Unchanged', 'Conflict', 'Invalid']):
+        metric.metric(action, int(counts.get(action, 0)))
+    st.dataframe(plan, hide_index=True, use_container_width=True)
+
+    to_write = supplier_import.changes(plan)
+    effective_from = st.date_input("Effective from", value=None, key=f'{key}_from', help="Leave blank to correct the current rules; set a date to start new versions from then")
+    if st.button(f"💾 Apply {len(to_write)} change(s)", disabled=to_write.empty, key=f'{key}_apply'):
+        # Conflicting and invalid rows are left out; everything else is written in one transaction
+        rules_store.upsert(filename, to_write, effective_from=effective_from)
+        # A toast survives the rerun the callers do next
+        st.toast(f"Saved {len(to_write)} supplier(s).")
+        return True
+    return False
+
+
+def bulk_import(filename, rules_df, service_types):
+    with st.expander("📥 Bulk import suppliers"):
+        upload = st.file_uploader("CSV or Excel with Supplier Name, Service Type and optionally Taxes Included", type=['csv', 'xlsx'], key='supplier_import')
+        if not upload:
+            return
+        try:
+            incoming = supplier_import.read_supplier_file(upload.name, upload.getvalue())
+        except ValueError as e:
+            st.error(str(e))
+            return
+
+        plan = supplier_import.plan_import(incoming, rules_df, service_types)
+        if review_and_apply(filename, plan, 'supplier_import'):
+            st.rerun()
+
+
+def juniper_sync(filename, rules_df, service_types):
+    with st.expander("🔄 Sync suppliers from Juniper"):
+        st.caption("Proposes the Juniper suppliers that have no mapping yet. Existing mappings are never changed.")
+        if st.button("Fetch supplier list"):
+            with st.spinner("Fetching suppliers from Juniper..."):
+                try:
+                    st.session_state['juniper_suppliers'] = juniper_api.fetch_supplier_list()
+                except RuntimeError as e:
+                    st.error(str(e))
+        juniper_suppliers = st.session_state.get('juniper_suppliers')
+        if not juniper_suppliers:
+            return
+
+        plan = supplier_import.plan_sync(juniper_suppliers, rules_df, service_types, utils.load_rules('supplier_aliases.csv'))
+        if plan.empty:
+            st.info(f"All {len(juniper_suppliers):,} Juniper suppliers are already mapped.")
+            return
+        if review_and_apply(filename, plan, 'juniper_sync'):
+            st.rerun()
 
 utils.hide_home_page()
 utils.add_logo()
 
-with open('./common/config.yaml') as file:
-    config = yaml.load(file, Loader=SafeLoader)
-
-authenticator = stauth.Authenticate(
-    config['credentials'],
-    config['cookie']['name'],
-    config['cookie']['key'],
-    config['cookie']['expiry_days'],
-    config['pre-authorized']
-)
+authenticator = utils.get_authenticator()
 
 authenticator.login(max_login_attempts=5, clear_on_submit=True)
 
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+from common import exports
+
+
+def test_chunk_bounds_never_split_a_group():
+    assert exports.chunk_bounds([2, 2, 3, 1], chunk_size=4) == [(0, 4), (4, 8)]
+
+
+def test_chunk_bounds_give_an_oversized_group_its_own_chunk():
+    assert exports.chunk_bounds([1, 6, 1, 1], chunk_size=4) == [(0, 1), (1, 7), (7, 9)]
+    assert exports.chunk_bounds([9], chunk_size=4) == [(0, 9)]
+
+
+def test_chunk_bounds_cover_every_row():
+    sizes = np.random.default_rng(0).integers(1, 50, size=500)
+    bounds = exports.chunk_bounds(sizes, chunk_size=100)
+    assert bounds[0][0] == 0 and bounds[-1][1] == sizes.sum()
+    assert all(end == start for (_, end), (start, _) in zip(bounds, bounds[1:]))
+    assert all(end - start <= 100 for start, end in bounds)
+
+
+def test_split_chunks_keeps_rows_with_blank_keys():
+    df = pd.DataFrame({'Invoice No': [2, np.nan, 1, 1, np.nan, 3], 'Line': range(6)})
+    chunks = exports.split_chunks(df, 'Invoice No', chunk_size=2)
+    assert sorted(pd.concat(chunks)['Line']) == list(range(6))
+    assert [chunk['Invoice No'].tolist() for chunk in chunks][:2] == [[1.0, 1.0], [2.0, 3.0]]
+    # Blank keys are grouped together at the end
+    assert chunks[-1]['Invoice No'].isna().all() and len(chunks[-1]) == 2
+
+
+def test_artifact_budget_counts_only_the_bytes_of_a_tuple(monkeypatch):
+    monkeypatch.setattr(exports, '_artifacts', type(exports._artifacts)())
+    monkeypatch.setattr(exports, '_artifacts_stats', {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0})
+    monkeypatch.setattr(exports, 'ARTIFACT_BUDGET_BYTES', 10)
+    report = exports.artifact(('report',), lambda: (b'12345678', ['a warning']))
+    assert report == (b'12345678', ['a warning'])
+    assert exports.cached_artifact(('report',)) == report
+    exports.artifact(('csv',), lambda: b'abcd')
+    assert exports.cached_artifact(('report',)) is None
+    assert exports.artifact_info()['bytes'] == 4
@@ -0,0 +1,62 @@
+import io
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from common import ingest
+
+
+def bookings(start_dates):
+    n = len(start_dates)
+    return pd.DataFrame({
+        'Area name': ['Dubai'] * n,
+        'Booking code': [f'B{i}' for i in range(n)],
+        'No. of nights': [1] * n,
+        'Start date': start_dates,
+        'End date': start_dates,
+        'Supplier name': ['Hotel A'] * n,
+        'Description': ['Room'] * n,
+        'Product group': ['Hotel'] * n,
+        'Product Type': ['Hotel'] * n,
+        'Final base sales in base currency': [100.0] * n,
+        'Final base cost in base currency': [80.0] * n,
+    })
+
+
+def parquet_bytes(df, date_type):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    schema = table.schema
+    for column in ingest.DATE_COLUMNS:
+        schema = schema.set(schema.get_field_index(column), pa.field(column, date_type))
+    buffer = io.BytesIO()
+    pq.write_table(table.cast(schema), buffer)
+    return buffer.getvalue()
+
+
+def test_parquet_microsecond_dates_are_read_as_nanoseconds():
+    dates = pd.to_datetime(['2024-01-15', '2024-03-31'])
+    df = ingest.parse_parquet(parquet_bytes(bookings(dates), pa.timestamp('us')))
+    for column in ingest.DATE_COLUMNS:
+        assert df[column].dtype == 'datetime64[ns]'
+        assert df[column].tolist() == dates.tolist()
+
+
+def test_parquet_timezone_aware_dates_are_made_naive():
+    dates = pd.to_datetime(['2024-01-15 12:00', '2024-03-31 12:00']).tz_localize('Asia/Dubai')
+    df = ingest.parse_parquet(parquet_bytes(bookings(dates), pa.timestamp('ms', tz='Asia/Dubai')))
+    for column in ingest.DATE_COLUMNS:
+        assert df[column].dtype == 'datetime64[ns]'
+        assert df[column].tolist() == dates.tz_convert(None).tolist()
+
+
+def test_csv_dates_are_parsed():
+    data = bookings(['2024-01-15', '2024-03-31']).to_csv(index=False).encode()
+    df = ingest.parse_csv(data)
+    assert df['Start date'].dtype == 'datetime64[ns]'
+    assert df['Final base sales in base currency'].dtype == 'float64'
+
+
+def test_csv_keeps_columns_beyond_the_required_ones():
+    upload = bookings(['2024-01-15', '2024-03-31']).assign(**{'Agent name': ['A', 'B']})
+    df = ingest.parse_csv(upload.to_csv(index=False).encode())
+    assert list(df.columns) == list(upload.columns)
+    assert df['Agent name'].tolist() == ['A', 'B']
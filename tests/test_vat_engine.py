@@ -0,0 +1,41 @@
+import warnings
+import pandas as pd
+from common import vat_engine
+
+
+def snapshot():
+    suppliers = pd.DataFrame({'Supplier Name': ['Hotel A', 'Hotel A', 'Hotel B'],
+                              'Service Type': ['Hotel Reservation'] * 3,
+                              'Taxes Included': [False, True, False],
+                              'Effective From': ['1900-01-01', '2024-04-01', '2024-06-01'],
+                              'Effective To': ['2024-04-01', None, None]})
+    areas = pd.DataFrame({'Area': ['Dubai'], 'Emirate': ['Dubai']})
+    services = pd.DataFrame({'Service Type': ['Hotel Reservation'], 'VAT Exempt': [False]})
+    vat = pd.DataFrame({'Emirate': ['Dubai'], 'Basic Division': [1.2], 'Service Charge': [10.0],
+                        'Municipality Fee': [7.0], 'VAT Percentage': [5.0]})
+    return vat_engine.RulesSnapshot.build(suppliers, areas, services, vat)
+
+
+def uploads(unit):
+    start = pd.Series(pd.to_datetime(['2024-01-15', '2024-05-01', '2024-01-15', None])).astype(f'datetime64[{unit}]')
+    return pd.DataFrame({'Supplier name': ['Hotel A', 'Hotel A', 'Hotel B', 'Hotel B'],
+                         'Area name': ['Dubai'] * 4,
+                         'Start date': start})
+
+
+def test_supplier_rules_as_of_start_date_for_non_nanosecond_dates():
+    rules = snapshot()
+    for unit in ('s', 'ms', 'us', 'ns'):
+        matched = rules.supplier_rules(uploads(unit))
+        # Hotel B's only version starts after its first booking; a blank date takes the latest version
+        assert matched['_matched'].tolist() == [True, True, False, True]
+        assert matched['Taxes Included'].tolist()[:2] == [False, True]
+
+
+def test_unmatched_rows_do_not_warn_about_incompatible_dtypes():
+    rules = snapshot()
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        matched = rules.supplier_rules(uploads('us'))
+        rules.supplier_rules(uploads('us').iloc[:2])
+    assert pd.isna(matched['Taxes Included'].iloc[2])
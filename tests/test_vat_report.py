@@ -0,0 +1,164 @@
+import numpy as np
+import pandas as pd
+import pytest
+from common import vat_engine
+
+VAT = pd.DataFrame({'Emirate': ['DXB', 'AJM'],
+                    'Basic Division': [1.225, 1.255],
+                    'Service Charge': [10.0, 10.0],
+                    'Municipality Fee': [7.0, 10.0],
+                    'VAT Percentage': [5.0, 5.0]})
+
+SUPPLIERS = pd.DataFrame({'Supplier Name': ['Hotel Net', 'Hotel Gross', 'Tours Net', 'Tours Gross', 'Visa Co', 'Air Co', 'Misc Co'],
+                          'Service Type': ['Hotel Reservation', 'Hotel Reservation', 'Excursion', 'Excursion', 'Visa', 'Air Ticket', 'Other'],
+                          'Taxes Included': [False, True, False, True, False, False, False]})
+
+AREAS = pd.DataFrame({'Area': ['Dubai Marina', 'Ajman City'], 'Emirate': ['DXB', 'AJM']})
+
+SERVICES = pd.DataFrame({'Service Type': ['Hotel Reservation', 'Excursion', 'Air Ticket', 'Visa', 'Other'],
+                         'VAT Exempt': [False, False, True, False, True]})
+
+
+@pytest.fixture
+def rules():
+    return vat_engine.RulesSnapshot.build(SUPPLIERS, AREAS, SERVICES, VAT)
+
+
+def bookings(rows):
+    """Upload rows from (supplier, area, description, sales, cost) tuples."""
+    df = pd.DataFrame(rows, columns=['Supplier name', 'Area name', 'Description',
+                                     'Final base sales in base currency', 'Final base cost in base currency'])
+    n = len(df)
+    return df.assign(**{'Booking code': [f'B{i}' for i in range(n)],
+                        'No. of nights': 1,
+                        'Start date': pd.Timestamp('2024-03-01'),
+                        'End date': pd.Timestamp('2024-03-02'),
+                        'Product group': 'Group',
+                        'Product Type': 'Type'})
+
+
+def test_classify_rows_joins_supplier_and_area_rules(rules):
+    df = bookings([('Hotel Net', 'Dubai Marina', 'Room', 100.0, 80.0),
+                   ('Tours Net', 'Paris', 'Tour', 50.0, 40.0),
+                   ('Unknown Co', 'Ajman City', 'Room', 10.0, 5.0)])
+    classified, supplier_not_found, area_not_found = vat_engine.classify_rows(df, rules)
+    assert classified['Service Type'].tolist()[:2] == ['Hotel Reservation', 'Excursion']
+    assert pd.isna(classified['Service Type'].iloc[2])
+    assert classified['Emirate'].tolist() == ['DXB', 'NA', 'AJM']
+    assert classified['Country'].tolist() == ['UAE', 'ROW', 'UAE']
+    assert supplier_not_found == {'Unknown Co'}
+    assert area_not_found == {'Paris'}
+
+
+def classified(rules, rows):
+    return vat_engine.classify_rows(bookings(rows), rules)[0]
+
+
+def baseline_hotel(row, tax_included, rates):
+    # The row-by-row formulas of the original HR TAX sheet
+    if tax_included:
+        basic = service_charge = municipality_fee = vat_paid = taxable_input = 0
+    else:
+        basic = row['Final base cost in base currency'] / rates['Basic Division']
+        service_charge = basic * (rates['Service Charge'] / 100)
+        municipality_fee = basic * (rates['Municipality Fee'] / 100)
+        vat_paid = (basic + service_charge) * (rates['VAT Percentage'] / 100)
+        taxable_input = vat_paid / (rates['VAT Percentage'] / 100)
+    vat_pct = rates['VAT Percentage']
+    total_vat = row['Final base sales in base currency'] / (100 + vat_pct) * vat_pct
+    return {'Basic': basic, 'Service Charge': service_charge, 'Municipality Fee': municipality_fee,
+            'VAT Paid': vat_paid, 'Taxable value input': taxable_input, 'Total VAT': total_vat,
+            'Taxable value output': total_vat / (vat_pct / 100), 'Net VAT payable': total_vat - vat_paid}
+
+
+def baseline_excursion(row, tax_included, rates):
+    # The row-by-row formulas of the original EX TAX sheet
+    vat_pct = rates['VAT Percentage']
+    sales = row['Final base sales in base currency']
+    cost = row['Final base cost in base currency']
+    vat_paid = 0 if tax_included else cost / (100 + vat_pct) * vat_pct
+    vat_output = sales / (100 + vat_pct) * vat_pct
+    return {'VAT Paid': vat_paid, 'Taxable value input': 0 if tax_included else vat_paid / (vat_pct / 100),
+            'Profit': sales - cost, 'VAT Output': vat_output,
+            'Taxable value output': vat_output / (vat_pct / 100), 'Net VAT payable': vat_output - vat_paid}
+
+
+def assert_matches_baseline(result, baseline):
+    for (_, row), expected in zip(result.iterrows(), baseline):
+        for column, value in expected.items():
+            assert row[column] == pytest.approx(value, rel=1e-12, abs=1e-12), column
+
+
+def test_hotel_vat_matches_baseline_formulas(rules):
+    df = classified(rules, [('Hotel Net', 'Dubai Marina', 'Room', 1050.0, 612.5),
+                            ('Hotel Net', 'Ajman City', 'Room', 210.0, 125.5),
+                            ('Hotel Gross', 'Dubai Marina', 'Room', 525.0, 400.0),
+                            ('Hotel Net', 'Dubai Marina', 'Refund', -105.0, -61.25)])
+    result = vat_engine.compute_hotel_vat(df, rules)
+    taxes_included = SUPPLIERS.set_index('Supplier Name')['Taxes Included']
+    rates = VAT.set_index('Emirate')
+    baseline = [baseline_hotel(row, taxes_included[row['Supplier name']], rates.loc[row['Emirate']]) for _, row in df.iterrows()]
+    assert_matches_baseline(result, baseline)
+    # Gross-priced hotels reclaim nothing
+    assert result.iloc[2][['Basic', 'VAT Paid', 'Taxable value input']].tolist() == [0, 0, 0]
+
+
+def test_excursion_vat_matches_baseline_formulas(rules):
+    df = classified(rules, [('Tours Net', 'Dubai Marina', 'Desert safari', 315.0, 210.0),
+                            ('Tours Gross', 'Ajman City', 'Boat tour', 105.0, 84.0),
+                            ('Tours Net', 'Ajman City', 'Boat tour', 0.0, 0.0)])
+    result = vat_engine.compute_excursion_vat(df, rules)
+    taxes_included = SUPPLIERS.set_index('Supplier Name')['Taxes Included']
+    rates = VAT.set_index('Emirate')
+    baseline = [baseline_excursion(row, taxes_included[row['Supplier name']], rates.loc[row['Emirate']]) for _, row in df.iterrows()]
+    assert_matches_baseline(result, baseline)
+
+
+def test_visa_vat_columns_are_zero(rules):
+    df = classified(rules, [('Visa Co', 'Dubai Marina', 'Tourist visa', 350.0, 300.0)])
+    result = vat_engine.compute_visa_vat(df)
+    visa_columns = vat_engine.SHEET_COLUMNS['VISA'][len(vat_engine.BASE_COLUMNS):]
+    assert result[visa_columns].to_numpy().tolist() == [[0.0] * len(visa_columns)]
+
+
+def test_sheet_layouts(rules):
+    df = classified(rules, [('Hotel Net', 'Dubai Marina', 'Room', 1050.0, 612.5),
+                            ('Hotel Net', 'Paris', 'Room', 200.0, 150.0),
+                            ('Tours Net', 'Dubai Marina', 'Tour', 315.0, 210.0),
+                            ('Tours Net', 'Paris', 'Tour', 100.0, 90.0),
+                            ('Visa Co', 'Dubai Marina', 'Visa', 350.0, 300.0)])
+    sheets = vat_engine.prepare_sheets(vat_engine.split_sheets(vat_engine.assign_sheets(df)), rules, parallel=False)
+    # ZERO sheets carry the upload amounts and no VAT columns
+    for name in ('HR ZERO', 'EX ZERO'):
+        assert list(sheets[name].columns) == vat_engine.BASE_COLUMNS
+        assert len(sheets[name]) == 1
+    assert list(sheets['HR TAX'].columns) == vat_engine.SHEET_COLUMNS['HR TAX']
+    assert 'Final Sale' in sheets['EX TAX'].columns and 'Final Cost' in sheets['EX TAX'].columns
+    assert sheets['EX TAX']['VAT Output'].iloc[0] == pytest.approx(15.0)
+    assert np.isclose(sheets['HR TAX']['Total VAT'].iloc[0], 50.0)
+
+
+def test_every_row_is_assigned_to_exactly_one_sheet(rules):
+    df = classified(rules, [('Hotel Net', 'Dubai Marina', 'Room', 1.0, 1.0),        # HR TAX
+                            ('Hotel Net', 'Paris', 'Room', 1.0, 1.0),               # HR ZERO
+                            ('Tours Net', 'Ajman City', 'Tour', 1.0, 1.0),          # EX TAX
+                            ('Tours Net', 'Paris', 'Tour', 1.0, 1.0),               # EX ZERO
+                            ('Air Co', 'Dubai Marina', 'Ticket', 1.0, 1.0),         # AIR TICKET
+                            ('Visa Co', 'Dubai Marina', 'Visa', 1.0, 1.0),          # VISA
+                            ('Misc Co', 'Paris', 'Insurance', 1.0, 1.0),            # OTHER NA
+                            ('Hotel Net', 'Dubai Marina', 'tdf', 1.0, 1.0),         # OTHER NA, not HR TAX
+                            ('Tours Net', 'Dubai Marina', 'COVER TDF', 1.0, 1.0),   # OTHER NA, not EX TAX
+                            ('Air Co', 'Paris', 'Covering TDF', 1.0, 1.0),          # OTHER NA, not AIR TICKET
+                            ('Visa Co', 'Paris', 'Visa', 1.0, 1.0),                 # no sheet: ROW visa
+                            ('Unknown Co', 'Dubai Marina', 'Room', 1.0, 1.0),       # no sheet: no service type
+                            ('Hotel Net', 'Dubai Marina', None, 1.0, 1.0)])         # HR TAX: blank description
+    tagged = vat_engine.assign_sheets(df)
+    assert tagged['Sheet'].tolist() == ['HR TAX', 'HR ZERO', 'EX TAX', 'EX ZERO', 'AIR TICKET', 'VISA',
+                                        'OTHER NA', 'OTHER NA', 'OTHER NA', 'OTHER NA',
+                                        vat_engine.UNASSIGNED, vat_engine.UNASSIGNED, 'HR TAX']
+
+    sheets = vat_engine.split_sheets(tagged)
+    assert set(sheets) == set(vat_engine.SHEETS) | {vat_engine.UNASSIGNED}
+    rows = pd.concat(sheets.values())['Booking code']
+    assert rows.is_unique and len(rows) == len(df)
+    assert sheets['OTHER NA']['Booking code'].tolist() == ['B6', 'B7', 'B8', 'B9']